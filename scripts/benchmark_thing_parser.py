@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Checks the /thing parser against the declxml schema it replaced and measures how fast both parse.
+
+Parses recorded /thing items with both parsers: a small response committed in fixtures/, the thing
+cache created by download_and_index.py --cache_bgg when there is one, and any XML files given.
+Exits with status 1 if any game differs.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import declxml as xml
+
+# Add the scripts directory to the path for imports
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+# Now import after path is set
+from gamecache.bgg_client import BGGClient, ThingCache  # noqa: E402
+from gamecache.downloader import CACHE_PATH  # noqa: E402
+from setup_logging import setup_logging  # noqa: E402
+
+BATCH_SIZE = 20
+# Recorded response covering alternate names, every link type, both polls and unranked games
+FIXTURE_PATH = script_dir / "fixtures" / "thing.xml"
+
+def declxml_games_list_to_games(data):
+    """The declxml schema _games_list_to_games used to be, kept as the reference for parity checks"""
+    def numplayers_to_result(_, results):
+        result = {result["value"].lower().replace(" ", "_"): int(result["numvotes"]) for result in results}
+
+        if not result:
+            result = {'best': 0, 'recommended': 0, 'not_recommended': 0}
+
+        is_recommended = result['best'] + result['recommended'] > result['not_recommended']
+        if not is_recommended:
+            return "not_recommended"
+
+        is_best = result['best'] > 10 and result['best'] > result['recommended']
+        if is_best:
+            return "b"
+
+        return "rec"
+
+    def suggested_numplayers(_, numplayers):
+        # Remove not_recommended player counts
+        numplayers = [players for players in numplayers if players["result"] != "not_recommended"]
+
+        # If there's only one player count, that's the best one
+        if len(numplayers) == 1:
+            numplayers[0]["result"] = "b"
+
+        # Just return the numbers
+        return [
+            (players["numplayers"], players["result"])
+            for players in numplayers
+        ]
+
+    def age_conversion(_, age_result):
+        return int(age_result[:2])
+
+    def suggested_playerage(_, playerages):
+
+        suggested_ages = [ages for ages in playerages if ages["numvotes"] > 0]
+
+        return suggested_ages
+
+    game_processor = xml.dictionary("items", [
+        xml.array(
+            xml.dictionary(
+                "item",
+                [
+                    xml.integer(".", attribute="id"),
+                    xml.string(".", attribute="type"),
+                    xml.string("image", required=False),
+                    xml.string("thumbnail", required=False),
+                    xml.string("name[@type='primary']", attribute="value", alias="name"),
+                    xml.array(
+                        xml.string(
+                            "name",
+                            attribute="value",
+                            required=False
+                        ),
+                        alias="alternate_names"
+                    ),
+                    xml.string("description"),
+                    xml.array(
+                        xml.string(
+                            "link[@type='boardgamecategory']",
+                            attribute="value",
+                            required=False
+                        ),
+                        alias="categories",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgamefamily']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name")
+                            ],
+                            required=False
+                        ),
+                        alias="families",
+                    ),
+                    xml.array(
+                        xml.string(
+                            "link[@type='boardgamemechanic']",
+                            attribute="value",
+                            required=False
+                        ),
+                        alias="mechanics",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgameexpansion']", [
+                                xml.integer(".", attribute="id"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="expansions",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgamecompilation']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="contained",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgameimplementation']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="reimplements",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgameintegration']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="integrates",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgamedesigner']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="designers",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgameartist']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="artists",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgamepublisher']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="publishers",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgame']", [
+                                xml.integer(".", attribute="id"),
+                                xml.string(".", attribute="value", alias="name"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="basegame",
+                    ),
+                    xml.array(
+                        xml.dictionary(
+                            "link[@type='boardgameaccessory']", [
+                                xml.integer(".", attribute="id"),
+                                xml.boolean(".", attribute="inbound", required=False),
+                            ],
+                            required=False
+                        ),
+                        alias="accessories",
+                    ),
+                    xml.array(
+                        xml.dictionary("poll[@name='suggested_numplayers']/results", [
+                            xml.string(".", attribute="numplayers"),
+                            xml.array(
+                                xml.dictionary("result", [
+                                    xml.string(".", attribute="value"),
+                                    xml.integer(".", attribute="numvotes"),
+                                ], required=False),
+                                hooks=xml.Hooks(after_parse=numplayers_to_result)
+                            )
+                        ], required=False),
+                        alias="suggested_numplayers",
+                        hooks=xml.Hooks(after_parse=suggested_numplayers),
+                    ),
+                    xml.string(
+                        "statistics/ratings/averageweight",
+                        attribute="value",
+                        alias="weight"
+                    ),
+                    xml.string(
+                        "statistics/ratings/ranks/rank[@friendlyname='Board Game Rank']",
+                        attribute="value",
+                        required=False,
+                        alias="rank"
+                    ),
+                    xml.array(
+                        xml.dictionary("statistics/ratings/ranks/rank", [
+                            xml.string(".", attribute="friendlyname"),
+                            xml.string(".", attribute="value"),
+                            xml.string(".", attribute="id"),
+                        ],
+                            required=False),
+                        alias="other_ranks",
+                    ),
+                    xml.string(
+                        "statistics/ratings/usersrated",
+                        attribute="value",
+                        alias="usersrated"
+                    ),
+                    xml.string(
+                        "statistics/ratings/average",
+                        attribute="value",
+                        alias="average"
+                    ),
+                    xml.string(
+                        "statistics/ratings/owned",
+                        attribute="value",
+                        alias="numowned"
+                    ),
+                    xml.string(
+                        "statistics/ratings/average",
+                        attribute="value",
+                        alias="rating"
+                    ),
+                    xml.string("playingtime", attribute="value", alias="playing_time", required=False),
+                    xml.integer("yearpublished", attribute="value", alias="year"),
+                    xml.integer(
+                        "minage",
+                        attribute="value",
+                        alias="min_age",
+                        required=False,
+                    ),
+                    xml.integer(
+                        "minplayers",
+                        attribute="value",
+                        alias="min_players",
+                        required=False,
+                    ),
+                    xml.integer(
+                        "maxplayers",
+                        attribute="value",
+                        alias="max_players",
+                        required=False,
+                    ),
+                    xml.array(
+                        xml.dictionary("poll[@name='suggested_playerage']/results/result", [
+                            xml.string(".", attribute="value", alias="age",
+                                       hooks=xml.Hooks(after_parse=age_conversion)),
+                            xml.integer(".", attribute="numvotes"),
+                        ], required=False),
+                        alias="suggested_playerages",
+                        hooks=xml.Hooks(after_parse=suggested_playerage),
+                    ),
+                ],
+                required=False,
+                alias="items",
+            )
+        )
+    ])
+    games = xml.parse_from_string(game_processor, data)
+    games = games["items"]
+
+    return games
+
+def load_documents(args):
+    """Returns /thing documents of up to BATCH_SIZE items, like the ones BGG answers with"""
+    documents = [Path(path).read_bytes() for path in [FIXTURE_PATH, *args.files]]
+
+    if Path(args.path).exists():
+        thing_cache = ThingCache(args.path)
+        ids = [row[0] for row in thing_cache.db.read("SELECT id FROM thing_cache ORDER BY id")]
+        items = list(thing_cache.get_many(ids, expire_after=float("inf")).values())
+        for i in range(0, len(items), BATCH_SIZE):
+            documents.append(b"<items>" + b"".join(items[i:i + BATCH_SIZE]) + b"</items>")
+
+    return documents
+
+def check_parity(client, documents):
+    """Prints every game the two parsers disagree on, returning the number of games compared"""
+    compared = 0
+    mismatches = 0
+    for document in documents:
+        expected = declxml_games_list_to_games(document)
+        actual = client._games_list_to_games(document)
+        if len(expected) != len(actual):
+            print(f"Parsed {len(actual)} games instead of {len(expected)}")
+            mismatches += 1
+        for expected_game, actual_game in zip(expected, actual):
+            compared += 1
+            if expected_game != actual_game:
+                mismatches += 1
+                keys = [key for key in expected_game if expected_game.get(key) != actual_game.get(key)]
+                extra = [key for key in actual_game if key not in expected_game]
+                print(f"Game {expected_game['id']} differs in {keys + extra}")
+                for key in keys + extra:
+                    print(f"  declxml: {expected_game.get(key)!r}")
+                    print(f"  parser:  {actual_game.get(key)!r}")
+    return compared, mismatches
+
+def benchmark(parse, documents, repeat):
+    """Returns the games parsed per second over repeat passes through documents"""
+    games = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for document in documents:
+            games += len(parse(document))
+    return games / (time.perf_counter() - started)
+
+def main(args):
+    documents = load_documents(args)
+
+    client = BGGClient()
+    compared, mismatches = check_parity(client, documents)
+    print(f"Compared {compared} games in {len(documents)} documents, {mismatches} differ")
+
+    reference = benchmark(declxml_games_list_to_games, documents, args.repeat)
+    parser = benchmark(client._games_list_to_games, documents, args.repeat)
+    print(f"declxml: {reference:,.0f} games/s")
+    print(f"parser:  {parser:,.0f} games/s ({parser / reference:.1f}x)")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description='Check and benchmark the /thing parser against declxml')
+    parser.add_argument(
+        'files',
+        nargs='*',
+        help="Recorded /thing responses to parse, in addition to the fixture and the items in the cache."
+    )
+    parser.add_argument(
+        '--path',
+        type=str,
+        default=CACHE_PATH,
+        help=f"Path to the cache file (default: {CACHE_PATH} from the working directory)."
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help="Passes through the documents when measuring throughput (default: 5)."
+    )
+
+    args = parser.parse_args()
+
+    main(args)
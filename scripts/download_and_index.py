@@ -8,7 +8,8 @@ script_dir = Path(__file__).parent
 sys.path.insert(0, str(script_dir))
 
 # Now import after path is set
-from gamecache.downloader import Downloader  # noqa: E402
+from gamecache.downloader import CACHE_PATH, CACHE_POLICIES, CACHE_TTL, DEFAULT_STATUSES, Downloader  # noqa: E402
+from gamecache.http_client import CachedHttpClient  # noqa: E402
 from gamecache.sqlite_indexer import SqliteIndexer  # noqa: E402
 from gamecache.github_integration import setup_github_integration  # noqa: E402
 from gamecache.config import parse_config_file, create_nested_config  # noqa: E402
@@ -26,11 +27,18 @@ def main(args):
         cache_bgg=args.cache_bgg,
         debug=args.debug,
         token=token,
+        jobs=args.jobs,
+        incremental=args.incremental,
+        cache_max_mb=args.cache_max_mb,
+        shared_rate_limit=args.shared_rate_limit,
+        trace_path=args.trace,
     )
     extra_params = {} # SETTINGS["boardgamegeek"].get("extra_params", {"own": 1})
+    statuses = SETTINGS["boardgamegeek"]["statuses"]
     collection = downloader.collection(
         user_name=SETTINGS["boardgamegeek"]["user_name"],
         extra_params=extra_params,
+        statuses=DEFAULT_STATUSES if statuses is None else statuses,
     )
 
     #TODO Fix allowing duplicates
@@ -53,7 +61,10 @@ def main(args):
 
     # Create SQLite database
     sqlite_path = "gamecache.sqlite"
-    indexer = SqliteIndexer(sqlite_path)
+    image_cache = None
+    if args.cache_bgg:
+        image_cache = CachedHttpClient(cache_name=CACHE_PATH, expire_after=CACHE_TTL, policies=CACHE_POLICIES)
+    indexer = SqliteIndexer(sqlite_path, incremental=args.incremental, image_cache=image_cache, jobs=args.jobs)
     indexer.add_objects(collection)
     print(f"Created SQLite database with {num_games} games and {num_expansions} expansions.")
 
@@ -61,7 +72,8 @@ def main(args):
     gzip_path = f"{sqlite_path}.gz"
     with open(sqlite_path, 'rb') as f_in, gzip.open(gzip_path, 'wb') as f_out:
         f_out.write(f_in.read())
-    if not args.save_db:
+    # Incremental runs update the previous database in place, so it has to be kept
+    if not args.save_db and not args.incremental:
         os.remove(sqlite_path)
     print(f"Created gzipped database: {gzip_path}")
 
@@ -106,11 +118,55 @@ if __name__ == '__main__':
             "fast the second time it's run."
         )
     )
+    parser.add_argument(
+        '--cache_max_mb',
+        type=int,
+        default=256,
+        help=(
+            "Largest size in MB the BGG cache may grow to before the least recently used "
+            "entries are evicted (default: 256). Expired entries are always removed."
+        )
+    )
     parser.add_argument(
         '--debug',
         action='store_true',
         help="Print debug information, such as requests made and responses received."
     )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=4,
+        help=(
+            "Number of BGG requests to keep in flight at once (default: 4). "
+            "All jobs share one rate limit, so this never increases the request rate."
+        )
+    )
+    parser.add_argument(
+        '--shared_rate_limit',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Share one BGG rate limit with every other process given the same file, e.g. "
+            "when running one process per BGG account on the same host."
+        )
+    )
+    parser.add_argument(
+        '--trace',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Append one JSON line per BGG request to PATH, with its URL, size, latency, "
+            "cache tier, retries and time spent queued."
+        )
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=(
+            "Only download collection items changed since the last run and update the "
+            "existing SQLite database in place. Implies keeping the unzipped database."
+        )
+    )
     parser.add_argument(
         '--config',
         type=str,
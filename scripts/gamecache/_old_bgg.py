@@ -0,0 +1,1077 @@
+import atexit
+import heapq
+import itertools
+import logging
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from xml.etree.ElementTree import ParseError, XMLPullParser, fromstring, tostring
+from urllib.parse import unquote
+
+from .http_client import CacheDatabase, CachedHttpClient, HttpSession, ResponseCompressor
+from .rate_limiter import AdaptiveRateController, CircuitBreaker, SharedTokenBucket, TokenBucket
+from .single_flight import SingleFlight
+from .tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+class BGGClient:
+    BASE_URL = "https://www.boardgamegeek.com/xmlapi2"
+    DEFAULT_JOBS = 4
+    REQUESTS_PER_SECOND = 2.0
+    PLAYS_PER_PAGE = 100
+
+    def __init__(self, cache=None, token="", debug=False, jobs=DEFAULT_JOBS, requests_per_second=REQUESTS_PER_SECOND,
+                 thing_cache=None, rate_state_path=None, shared_rate_limit=None, tracer=None):
+        # One bucket shared by every worker, so more jobs never means more requests per second.
+        # With shared_rate_limit it is also shared with every other process using that file.
+        self.jobs = max(1, jobs)
+        if shared_rate_limit:
+            self.rate_limiter = SharedTokenBucket(shared_rate_limit, rate=requests_per_second, capacity=self.jobs)
+        else:
+            self.rate_limiter = TokenBucket(rate=requests_per_second, capacity=self.jobs)
+        # Tunes the bucket's rate and the requests in flight to what BGG tolerates, starting
+        # from what earlier runs learned when rate_state_path is set
+        self.rate_controller = AdaptiveRateController(
+            self.rate_limiter,
+            max_concurrency=self.jobs,
+            state_path=rate_state_path,
+        )
+        if rate_state_path:
+            atexit.register(self.rate_controller.save)
+
+        self.session = HttpSession(rate_limiter=self.rate_limiter)
+        if not cache:
+            self.requester = self.session
+            self.thing_cache = thing_cache
+        else:
+            self.requester = cache.cache
+            self.requester.rate_limiter = self.rate_limiter
+            # Stale entries are refreshed in the background, they must respect throttling too
+            self.requester.refresh_via = self._send
+            self.thing_cache = thing_cache or cache.things
+
+        self.headers = {
+            'Authorization': f'Bearer {token}'
+        }
+
+        self.circuit_breaker = CircuitBreaker()
+        self.tracer = tracer or Tracer()
+        self.scheduler = RequestScheduler(self)
+        # Thing ids currently being downloaded, shared by concurrent _fetch_things calls
+        self.thing_flights = SingleFlight()
+
+        if debug:
+            logging.basicConfig(level=logging.DEBUG)
+
+    def collection(self, user_name, **kwargs):
+        data = self.prime_collection(user_name, **kwargs).result()
+        collection = self._collection_to_games(data)
+        return collection
+
+    def collection_ids(self, user_name, **kwargs):
+        """Returns the collection_id of every item in the collection, using the much smaller brief response"""
+        data = self.prime_collection(user_name, brief=1, **kwargs).result()
+        return [int(item.get("collid")) for item in iter_items(data, "items", "item")]
+
+    def prime_collection(self, user_name, **kwargs):
+        """
+        Fires a collection request so BGG starts preparing it, without waiting for the answer.
+
+        Returns a future for the response body. Priming the same request again, or calling
+        collection() with the same arguments, reuses that future.
+        """
+        params = kwargs.copy()
+        params["username"] = unquote(user_name)
+        return self.scheduler.submit("/collection?version=1", params)
+
+    def plays(self, user_name, **kwargs):
+        """Returns every play logged by user_name, see iter_plays()"""
+        return list(self.iter_plays(user_name, **kwargs))
+
+    def iter_plays(self, user_name, **kwargs):
+        """
+        Yields every play logged by user_name, in no particular order.
+
+        Page 1 reports the total number of plays, so every other page is submitted at once
+        and its plays are yielded as soon as it arrives. A play seen on two pages, because
+        plays were logged while paging, is only yielded once.
+
+        Args:
+            **kwargs: Extra /plays parameters, e.g. mindate="YYYY-MM-DD" for only the plays since then.
+        """
+        params = kwargs.copy()
+        params["username"] = unquote(user_name)
+
+        def submit(page):
+            return self.scheduler.submit("/plays?version=1", dict(params, page=page), reuse=False)
+
+        seen = set()
+
+        def unseen(plays):
+            for play in plays:
+                if play["playid"] not in seen:
+                    seen.add(play["playid"])
+                    yield play
+
+        attributes = {}
+        plays = self._plays_to_games(submit(1).result(), attributes=attributes)
+        yield from unseen(plays)
+
+        total = attributes.get("total", "")
+        if not total.isdigit():
+            # Without a total, walk the pages until an empty one
+            page = 2
+            while plays:
+                plays = self._plays_to_games(submit(page).result())
+                yield from unseen(plays)
+                page += 1
+            return
+
+        pages = math.ceil(int(total) / BGGClient.PLAYS_PER_PAGE)
+        futures = [submit(page) for page in range(2, pages + 1)]
+        for future in as_completed(futures):
+            yield from unseen(self._plays_to_games(future.result()))
+
+    def game_list(self, game_ids, additional_details = True):
+        return self.game_lists(game_ids, additional_details=additional_details)[0]
+
+    def game_lists(self, *id_lists, additional_details=True, unchanged_ids=(), unchanged_ttl=None):
+        """
+        Fetches several lists of thing ids with a single download plan.
+
+        Every id across all lists is requested once, packed into full batches. When
+        additional_details is set, the integrates, reimplements and contained entries of
+        the fetched games are resolved in a second pass that only requests ids which were
+        not already downloaded.
+
+        Args:
+            unchanged_ids (iterable, optional): Ids whose cached details may be reused for up to
+                unchanged_ttl seconds instead of the thing cache's normal TTL.
+
+        Returns:
+            list: One list of games per id list, in the order of first appearance.
+        """
+        things = self._fetch_things(
+            [id_ for ids in id_lists for id_ in ids],
+            desc="Downloading games" if additional_details else None,
+            unchanged_ids=set(unchanged_ids),
+            unchanged_ttl=unchanged_ttl,
+        )
+
+        if additional_details:
+            self._fetch_related_metadata(things)
+
+        return [
+            [things[id_] for id_ in dict.fromkeys(ids) if id_ in things]
+            for ids in id_lists
+        ]
+
+    def _fetch_things(self, game_ids, known=None, desc=None, unchanged_ids=frozenset(), unchanged_ttl=None):
+        """
+        Downloads every id not in known, in full batches of 20, returning a dict of id to game.
+
+        With a thing cache, ids that have a fresh cached item are served from it and only the
+        missing or stale ids are packed into batches. Ids in unchanged_ids count as fresh for
+        unchanged_ttl seconds. Ids another call is already downloading are waited for instead
+        of being requested again.
+
+        A batch BGG keeps failing on is split in halves until the failing ids are isolated.
+        Those get their last known cached details, or are left out.
+        """
+        known = known or {}
+        missing = [id_ for id_ in dict.fromkeys(game_ids) if id_ not in known]
+
+        things = {}
+        if self.thing_cache:
+            cached = self.thing_cache.get_many([id_ for id_ in missing if id_ not in unchanged_ids])
+            cached.update(self.thing_cache.get_many(
+                [id_ for id_ in missing if id_ in unchanged_ids],
+                expire_after=unchanged_ttl,
+            ))
+            if cached:
+                for game in self._games_list_to_games(b"<items>" + b"".join(cached.values()) + b"</items>"):
+                    things[game["id"]] = game
+                missing = [id_ for id_ in missing if id_ not in cached]
+
+        # Split game_ids into smaller chunks to avoid "414 URI too long"
+        def chunks(iterable, n):
+            for i in range(0, len(iterable), n):
+                yield iterable[i:i + n]
+
+        def submit_batch(game_ids_subset):
+            url = "/thing/?stats=1&id=" + ",".join(str(id_) for id_ in game_ids_subset)
+            # Items are cached individually, so skip the URL cache for the batch itself
+            requester = self.session if self.thing_cache else None
+            return self.scheduler.submit(url, {}, requester=requester, reuse=False)
+
+        def last_known(id_, error):
+            """Falls back to the cached details of an id BGG keeps failing on, however old"""
+            cached = self.thing_cache.get_many([id_], expire_after=float("inf")) if self.thing_cache else {}
+            if id_ in cached:
+                logger.warning(f"BGG keeps failing on thing {id_} ({error}), using its last known details")
+                return self._games_list_to_games(b"<items>" + cached[id_] + b"</items>")
+            logger.warning(f"BGG keeps failing on thing {id_} ({error}), skipping it")
+            return []
+
+        def download_batch(game_ids_subset, future):
+            """Returns the games of a batch, splitting it in halves while BGG fails on it"""
+            raw_items = {} if self.thing_cache else None
+            try:
+                games = self._games_list_to_games(future.result(), raw_items=raw_items)
+            except BGGRetryableError:
+                # Out of retries because BGG is throttling or down, not because of the ids.
+                # Splitting would only make more requests BGG refuses.
+                raise
+            except (BGGException, ParseError) as e:
+                if len(game_ids_subset) == 1:
+                    return last_known(game_ids_subset[0], e)
+                logger.warning(
+                    f"Batch of {len(game_ids_subset)} things failed ({e}), splitting it to find the bad ids"
+                )
+                half = len(game_ids_subset) // 2
+                # Submit both halves before waiting on either
+                halves = [(part, submit_batch(part)) for part in (game_ids_subset[:half], game_ids_subset[half:])]
+                return [game for part, part_future in halves for game in download_batch(part, part_future)]
+
+            if self.thing_cache:
+                self.thing_cache.set_many(raw_items)
+            return games
+
+        def collect_batch(game_ids_subset, future):
+            try:
+                games = download_batch(game_ids_subset, future)
+            except Exception as e:
+                self.thing_flights.fail(game_ids_subset, e)
+                raise
+            by_id = {game["id"]: game for game in games}
+            # Ids BGG doesn't know resolve to None
+            self.thing_flights.resolve({id_: by_id.get(id_) for id_ in game_ids_subset})
+            return games
+
+        owned, in_flight = self.thing_flights.claim(missing)
+        chunked = list(chunks(list(owned), 20))
+        # Every batch is scheduled up front, a failing one is retried later while the rest proceed
+        batches = [(subset, submit_batch(subset)) for subset in chunked]
+        if desc:
+            batches = tqdm(batches, desc=desc, unit="batch")
+        error = None
+        for subset, future in batches:
+            try:
+                for game in collect_batch(subset, future):
+                    things[game["id"]] = game
+            except Exception as e:
+                # Keep collecting, so every claimed id is resolved or failed
+                error = error or e
+        if error:
+            raise error
+
+        for id_, future in in_flight.items():
+            game = future.result()
+            if game is not None:
+                things[id_] = game
+        return things
+
+    def _fetch_related_metadata(self, things):
+        """Fills image, thumbnail, rating and year on related entries of every game in things"""
+        entries = []
+        for game in things.values():
+            # These can also be on Box of Promos
+            entries += game.get("contained", [])
+            if game["type"] == "boardgame":
+                entries += game.get("integrates", [])
+                entries += game.get("reimplements", [])
+
+        related_ids = [entry["id"] for entry in entries if entry.get("id")]
+        try:
+            details_by_id = self._fetch_things(related_ids, known=things, desc="Downloading related items")
+        except Exception as e:
+            logger.error(f"Failed to fetch image/thumbnail for related items {related_ids}: {e}")
+            return
+
+        details_by_id.update(things)
+        for entry in entries:
+            details = details_by_id.get(entry.get("id"))
+            if details:
+                entry["image"] = details.get("image", "")          # Image URL for the entry
+                entry["thumbnail"] = details.get("thumbnail", "")  # Thumbnail URL for the entry
+                entry["rating"] = details.get("rating", "")
+                entry["year"] = details.get("year", "")
+            else:
+                entry["image"] = None
+                entry["thumbnail"] = None
+                entry["rating"] = None
+                entry["year"] = None
+
+    def _make_request(self, url, params={}, requester=None, trace=None):
+        """
+        Makes a single request to the specified URL with the given parameters.
+
+        Args:
+            url (str): The URL to make the request to.
+            params (dict, optional): The parameters to include in the request. Defaults to an empty dictionary.
+            requester (optional): The session to use instead of self.requester, e.g. to bypass the URL cache.
+            trace (dict, optional): Receives the latency and, once answered, the URL, size and cache tier
+                of the response.
+
+        Returns:
+            bytes: The response body, left undecoded for the parsers.
+
+        Raises:
+            BGGException: If the response contains XML errors.
+
+        Notes:
+            - Nothing is retried here, retrying is left to RequestScheduler so a failing request
+              never holds up the others.
+            - If the request fails, `BGGRetryableError` is raised. If BGG answered "Too Many Requests",
+              it is the `BGGThrottled` subclass and the circuit breaker is told, pausing all requests
+              once BGG is clearly throttling.
+            - If BGG accepted the request into its queue instead of answering, `BGGRequestQueued` is raised
+              without waiting, so the request can be polled again later.
+            - If the response contains XML errors, a `BGGException` is raised with the specific error messages.
+        """
+        requester = requester or self.requester
+        response = self._send(
+            lambda: requester.get(BGGClient.BASE_URL + url, params=params, headers=self.headers), url, trace
+        )
+
+        if trace is not None:
+            trace["url"] = response.url
+            trace["bytes"] = len(response.content)
+            trace["cache"] = response.cache_tier or "network"
+
+        # Pretty-printing decodes and reparses the whole body, only do it when it will be shown
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("REQUEST: %s", response.url)
+            logger.debug("RESPONSE: \n%s", prettify_if_xml(response.text))
+
+        # Only BGG's small message and error documents are parsed here, payloads are
+        # parsed once, incrementally, by the converters
+        if root_tag(response.content) in UNCACHEABLE_ROOT_TAGS:
+            raise_for_envelope(fromstring(response.content), response.url)
+
+        return response.content
+
+    def _send(self, get, url, trace=None):
+        """
+        Calls get() to send a request once the circuit breaker and rate controller allow it.
+
+        Args:
+            get: Callable making the request and returning the HttpResponse
+            url (str): The URL requested, for error messages
+            trace (dict, optional): Receives the latency of the request.
+
+        Returns:
+            HttpResponse: The response, after telling the breaker and controller it succeeded.
+
+        Raises:
+            BGGThrottled: If BGG answered "Too Many Requests".
+            BGGRetryableError: If the request failed in any other way.
+        """
+        self.circuit_breaker.wait()
+
+        with self.rate_controller.slot():
+            try:
+                response = get()
+                response.raise_for_status()  # This will raise an exception for 4xx and 5xx status codes
+            except Exception as e:
+                if trace is not None:
+                    elapsed = getattr(e, "elapsed", None)
+                    trace["latency"] = round(elapsed, 4) if elapsed is not None else None
+                # Handle both requests exceptions and our simple cache exceptions
+                error_message = str(e)
+                status_code = getattr(e, "status_code", None)
+                retry_after = getattr(e, "retry_after", None)
+
+                # Check for Too Many Requests (429)
+                if status_code == 429 or "429" in error_message or "Too Many Requests" in error_message:
+                    self.rate_controller.record_throttle()
+                    self.circuit_breaker.record_throttle(retry_after)
+                    raise BGGThrottled(f"BGG returned Too Many Requests for {url}", retry_after)
+                if status_code == 503:
+                    # Overloaded, slow down but retry like any other error
+                    self.rate_controller.record_throttle()
+                # Other HTTP errors or connection errors
+                raise BGGRetryableError(f"Request for {url} failed: {error_message}", retry_after)
+
+        # The session times the network call alone, cache hits have no latency at all. Counting the wait
+        # for a rate limit token would make the controller's own throttling look like BGG slowing down.
+        latency = response.elapsed
+        self.circuit_breaker.record_success()
+        if latency is not None:
+            self.rate_controller.record_success(latency)
+
+        if trace is not None:
+            trace["latency"] = round(latency, 4) if latency is not None else None
+        return response
+
+    def _plays_to_games(self, data, attributes=None):
+        def play_to_dict(play):
+            item = play.find("item")
+            return {
+                "playid": int(play.get("id")),
+                "played_date": _attribute(play, "date"),
+                "game": {
+                    "gamename": _attribute(item, "name"),
+                    "gameid": int(item.get("objectid")),
+                },
+                "players": [
+                    _attribute(player, "name", default="Unknown")
+                    for player in play.iterfind("players/player")
+                ],
+            }
+
+        return [play_to_dict(play) for play in iter_items(data, "plays", "play", attributes=attributes)]
+
+    def _collection_to_games(self, data):
+        status_tags = ("fortrade", "own", "preordered", "prevowned", "want", "wanttobuy", "wanttoplay", "wishlist")
+
+        def item_to_game(item):
+            status = item.find("status")
+            return {
+                "id": int(item.get("objectid")),
+                "collection_id": int(item.get("collid")),
+                "name": _text(item.find("name")),
+                "image": _text(item.find("image")),
+                "thumbnail": _text(item.find("thumbnail")),
+                "image_version": _text(item.find("version/item/image")),
+                "thumbnail_version": _text(item.find("version/item/thumbnail")),
+                "version_name": _attribute(item.find("version/item/name"), "value"),
+                "version_year": _int_attribute(item.find("version/item/yearpublished"), "value"),
+                "publisher_ids": [
+                    _int_attribute(link, "id")
+                    for link in item.iterfind("version/item/link[@type='boardgamepublisher']")
+                ],
+                "version_publisher": _int_attribute(item.find("version/publisher"), "publisherid"),
+                "custom_version_year": _int_text(item.find("version/year")),
+                "comment": _text(item.find("comment")),
+                "wishlist_comment": _text(item.find("wishlistcomment")),
+                "last_modified": _attribute(status, "lastmodified"),
+                "tags": [tag for tag in status_tags if _attribute(status, tag) == "1"],
+                "wishlist_priority": _attribute(status, "wishlistpriority"),
+                "numplays": int(item.findtext("numplays")),
+            }
+
+        return [item_to_game(item) for item in iter_items(data, "items", "item")]
+
+    def _games_list_to_games(self, data, raw_items=None):
+        """
+        Converts a /thing document to a list of game dicts.
+
+        Args:
+            raw_items (dict, optional): Receives the XML of every item as bytes, by id, so it can be
+                cached without parsing the document a second time.
+        """
+        def numplayers_to_result(results):
+            result = {result["value"].lower().replace(" ", "_"): int(result["numvotes"]) for result in results}
+
+            if not result:
+                result = {'best': 0, 'recommended': 0, 'not_recommended': 0}
+
+            is_recommended = result['best'] + result['recommended'] > result['not_recommended']
+            if not is_recommended:
+                return "not_recommended"
+
+            is_best = result['best'] > 10 and result['best'] > result['recommended']
+            if is_best:
+                return "b"
+
+            return "rec"
+
+        def suggested_numplayers(numplayers):
+            # Remove not_recommended player counts
+            numplayers = [players for players in numplayers if players["result"] != "not_recommended"]
+
+            # If there's only one player count, that's the best one
+            if len(numplayers) == 1:
+                numplayers[0]["result"] = "b"
+
+            # Just return the numbers
+            return [
+                (players["numplayers"], players["result"])
+                for players in numplayers
+            ]
+
+        def age_conversion(age_result):
+            return int(age_result[:2])
+
+        def suggested_playerage(playerages):
+
+            suggested_ages = [ages for ages in playerages if ages["numvotes"] > 0]
+
+            return suggested_ages
+
+        def item_to_game(item):
+            """Walks the children of an <item> once, dispatching on their tag and type"""
+            found = {}
+            alternate_names = []
+            links = {key: [] for key, _ in THING_LINKS.values()}
+            numplayers = []
+            playerages = []
+            other_ranks = []
+
+            for child in item:
+                tag = child.tag
+                if tag == "link":
+                    link = THING_LINKS.get(child.get("type"))
+                    if link:
+                        key, to_entry = link
+                        links[key].append(to_entry(child))
+                elif tag == "name":
+                    alternate_names.append(_attribute(child, "value"))
+                    if child.get("type") == "primary":
+                        found.setdefault("name", child)
+                elif tag == "poll":
+                    poll_name = child.get("name")
+                    if poll_name == "suggested_numplayers":
+                        for results in child.iterfind("results"):
+                            numplayers.append({
+                                "numplayers": _attribute(results, "numplayers"),
+                                "result": numplayers_to_result([
+                                    {"value": _attribute(result, "value"), "numvotes": int(result.get("numvotes"))}
+                                    for result in results.iterfind("result")
+                                ]),
+                            })
+                    elif poll_name == "suggested_playerage":
+                        for result in child.iterfind("results/result"):
+                            playerages.append({
+                                "age": age_conversion(_attribute(result, "value")),
+                                "numvotes": int(result.get("numvotes")),
+                            })
+                elif tag == "statistics":
+                    for ratings in child.iterfind("ratings"):
+                        for stat in ratings:
+                            if stat.tag == "ranks":
+                                for rank in stat.iterfind("rank"):
+                                    other_ranks.append({
+                                        "friendlyname": _attribute(rank, "friendlyname"),
+                                        "value": _attribute(rank, "value"),
+                                        "id": _attribute(rank, "id"),
+                                    })
+                                    if rank.get("friendlyname") == "Board Game Rank":
+                                        found.setdefault("rank", rank)
+                            else:
+                                found.setdefault(stat.tag, stat)
+                else:
+                    # Like the XPath lookups this replaces, the first element of a tag wins
+                    found.setdefault(tag, child)
+
+            game = {
+                "id": int(item.get("id")),
+                "type": _attribute(item, "type"),
+                "image": _text(found.get("image")),
+                "thumbnail": _text(found.get("thumbnail")),
+                "name": _attribute(found.get("name"), "value"),
+                "alternate_names": alternate_names,
+                "description": _text(found.get("description")),
+            }
+            game.update(links)
+            game["suggested_numplayers"] = suggested_numplayers(numplayers)
+            game.update({
+                "weight": _attribute(found.get("averageweight"), "value"),
+                "rank": _attribute(found.get("rank"), "value"),
+                "other_ranks": other_ranks,
+                "usersrated": _attribute(found.get("usersrated"), "value"),
+                "average": _attribute(found.get("average"), "value"),
+                "numowned": _attribute(found.get("owned"), "value"),
+                "rating": _attribute(found.get("average"), "value"),
+                "playing_time": _attribute(found.get("playingtime"), "value"),
+                "year": int(found["yearpublished"].get("value")),
+                "min_age": _int_attribute(found.get("minage"), "value"),
+                "min_players": _int_attribute(found.get("minplayers"), "value"),
+                "max_players": _int_attribute(found.get("maxplayers"), "value"),
+                "suggested_playerages": suggested_playerage(playerages),
+            })
+
+            logger.debug("Successfully parsed: %s (id: %s).", game["name"], game["id"])
+            return game
+
+        games = []
+        for item in iter_items(data, "items", "item"):
+            games.append(item_to_game(item))
+            if raw_items is not None:
+                raw_items[games[-1]["id"]] = tostring(item, encoding="utf-8", xml_declaration=False)
+        return games
+
+
+# Preset zlib dictionary of markup that repeats throughout BGG's XML. zlib finds matches
+# nearest the end of the dictionary cheapest, so the most frequent fragments come last.
+BGG_XML_DICTIONARY = "\n\t\t".join([
+    '<?xml version="1.0" encoding="utf-8" standalone="yes"?>',
+    '<items termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">',
+    '<plays username="', '" userid="', '" total="', '" page="',
+    '" termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">',
+    '<play id="', '" date="', '" quantity="1" length="0" incomplete="0" nowinstats="0" location="">',
+    '<subtypes><subtype value="boardgame"/></subtypes>', '<players>',
+    '<player username="" userid="0" name="', '" startposition="" color="" score="" new="0" rating="0" win="0"/>',
+    '</players>', '</play>',
+    '<item objecttype="thing" objectid="', '" subtype="boardgameexpansion" collid="', '" subtype="boardgame" collid="',
+    '<name sortindex="1">', '<yearpublished>', '<version><item type="boardgameversion" id="',
+    '<status own="1" prevowned="0" fortrade="0" want="0" wanttoplay="0" wanttobuy="0" wishlist="0" '
+    'preordered="0" lastmodified="', '<numplays>0</numplays>', '<wishlistcomment>', '<comment>',
+    '<poll name="language_dependence" title="Language Dependence" totalvotes="',
+    '<result level="1" value="No necessary in-game text" numvotes="',
+    '<result level="2" value="Some necessary text - easily memorized or small crib sheet" numvotes="',
+    '<result level="3" value="Moderate in-game text - needs crib sheet or paste ups" numvotes="',
+    '<result level="4" value="Extensive use of text - massive conversion needed to be playable" numvotes="',
+    '<result level="5" value="Unplayable in another language" numvotes="',
+    '<poll-summary name="suggested_numplayers" title="User Suggested Number of Players">',
+    '<result name="bestwith" value="Best with ', '<result name="recommmendedwith" value="Recommended with ',
+    '</poll-summary>',
+    '<poll name="suggested_playerage" title="User Suggested Player Age" totalvotes="',
+    '<result value="2" numvotes="', '<result value="21 and up" numvotes="',
+    '<poll name="suggested_numplayers" title="User Suggested Number of Players" totalvotes="',
+    '<playingtime value="', '<minplaytime value="', '<maxplaytime value="', '<minage value="',
+    '<yearpublished value="', '<minplayers value="', '<maxplayers value="',
+    '<statistics page="1">', '<ratings>', '<usersrated value="', '<average value="', '<bayesaverage value="',
+    '<ranks>', '<rank type="subtype" id="1" name="boardgame" friendlyname="Board Game Rank" value="',
+    '<rank type="family" id="5497" name="strategygames" friendlyname="Strategy Game Rank" value="',
+    '<rank type="family" id="5496" name="thematic" friendlyname="Thematic Rank" value="',
+    '<rank type="family" id="5499" name="familygames" friendlyname="Family Game Rank" value="',
+    '<rank type="family" id="5498" name="partygames" friendlyname="Party Game Rank" value="',
+    '" bayesaverage="', '</ranks>', '<stddev value="', '<median value="0"/>', '<owned value="', '<trading value="',
+    '<wanting value="', '<wishing value="', '<numcomments value="', '<numweights value="', '<averageweight value="',
+    '</ratings>', '</statistics>', '</item>',
+    '<item type="boardgame" id="', '<item type="boardgameexpansion" id="', '<item type="boardgameaccessory" id="',
+    '<thumbnail>https://cf.geekdo-images.com/', '__thumb/img/', '=/fit-in/200x150/filters:strip_icc()/pic',
+    '</thumbnail>', '<image>https://cf.geekdo-images.com/', '__original/img/', '=/0x0/filters:format(jpeg)/pic',
+    '.jpg</image>', '.png</image>',
+    '<name type="primary" sortindex="1" value="', '<name type="alternate" sortindex="1" value="',
+    '<description>', '&amp;#10;&amp;#10;', '&amp;quot;', '&amp;ndash;', '&amp;rsquo;', '</description>',
+    '<results numplayers="', '<result value="Best" numvotes="', '<result value="Recommended" numvotes="',
+    '<result value="Not Recommended" numvotes="', '</results>', '</poll>',
+    '<link type="boardgamecategory" id="', '<link type="boardgamemechanic" id="',
+    '<link type="boardgameimplementation" id="', '<link type="boardgameintegration" id="',
+    '<link type="boardgamecompilation" id="', '<link type="boardgamedesigner" id="',
+    '<link type="boardgameartist" id="', '<link type="boardgamefamily" id="',
+    '<link type="boardgameexpansion" id="', '<link type="boardgamepublisher" id="',
+    '" inbound="true"/>', '" value="', '"/>',
+]).encode("utf-8")
+
+BGG_COMPRESSOR = ResponseCompressor(name="zlib-bgg1", zdict=BGG_XML_DICTIONARY)
+
+class CacheBackendSqlite:
+    def __init__(self, path, ttl, policies=(), thing_ttl=None):
+        self.cache = CachedHttpClient(
+            cache_name=path,
+            expire_after=ttl,
+            should_cache=is_cacheable_response,
+            compressor=BGG_COMPRESSOR,
+            policies=policies,
+        )
+        self.things = ThingCache(
+            cache_name=path,
+            expire_after=thing_ttl or ttl
+        )
+
+class ThingCache:
+    """SQLite cache of raw /thing <item> elements, keyed by thing id"""
+
+    def __init__(self, cache_name, expire_after=3600):
+        """
+        Args:
+            cache_name: Path of the cache database, shared with CachedHttpClient
+            expire_after: Per-item TTL in seconds
+        """
+        self.cache_path = cache_name
+        self.expire_after = expire_after
+        self.db = CacheDatabase.for_path(cache_name)
+        self._init_cache()
+
+    def _init_cache(self):
+        self.db.write("""
+            CREATE TABLE IF NOT EXISTS thing_cache (
+                id INTEGER PRIMARY KEY,
+                item_xml BLOB,
+                timestamp REAL,
+                encoding TEXT,
+                last_access REAL
+            )
+        """)
+        self.db.flush()
+
+        self.db.add_columns("thing_cache", {"encoding": "TEXT", "last_access": "REAL"})
+        self.db.write("CREATE INDEX IF NOT EXISTS thing_cache_timestamp ON thing_cache (timestamp)")
+        self.db.write("CREATE INDEX IF NOT EXISTS thing_cache_last_access ON thing_cache (last_access)")
+        self.db.flush()
+
+    def get_many(self, ids, expire_after=None):
+        """Returns a dict of id to item XML bytes for every id with an entry younger than expire_after seconds"""
+        found = {}
+        if not ids:
+            return found
+
+        min_timestamp = time.time() - (expire_after or self.expire_after)
+        # Stay well below SQLite's limit on bound parameters
+        for i in range(0, len(ids), 500):
+            subset = ids[i:i + 500]
+            rows = self.db.read(
+                "SELECT id, item_xml, encoding FROM thing_cache "
+                f"WHERE timestamp > ? AND id IN ({','.join('?' * len(subset))})",
+                (min_timestamp, *subset)
+            )
+            for id_, item_xml, encoding in rows:
+                try:
+                    item_xml = BGG_COMPRESSOR.unpack(item_xml, encoding)
+                except (ValueError, zlib.error):
+                    # Treat unreadable entries as missing, they are replaced on the next fetch
+                    continue
+                # Entries written before compression was added come back as str
+                found[id_] = item_xml.encode("utf-8") if isinstance(item_xml, str) else item_xml
+
+        if found:
+            now = time.time()
+            self.db.write_many("UPDATE thing_cache SET last_access = ? WHERE id = ?", [(now, id_) for id_ in found])
+        return found
+
+    def set_many(self, items):
+        """Stores a dict of id to item XML bytes, stamping every entry with the current time"""
+        now = time.time()
+        rows = []
+        for id_, item_xml in items.items():
+            blob, encoding = BGG_COMPRESSOR.pack(item_xml)
+            rows.append((id_, blob, now, encoding, now))
+        self.db.write_many(
+            "INSERT OR REPLACE INTO thing_cache (id, item_xml, timestamp, encoding, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+
+class RequestScheduler:
+    """
+    Runs BGG requests on a pool of workers, retrying and polling them on a schedule.
+
+    Every submitted request is fired as soon as a worker is free. Requests BGG has queued
+    are polled again on a backoff schedule capped at MAX_INTERVAL, and failed ones are put
+    back with a not-before time, honouring Retry-After. Waiting requests never occupy a
+    worker, so callers only block on the future of the request they actually need while
+    everything else keeps running.
+    """
+    FIRST_INTERVAL = 5
+    MAX_INTERVAL = 60
+    MAX_WAIT = 60 * 20
+    MAX_RETRIES = 10
+    # Throttled requests back off from 30s, so they get fewer tries before giving up
+    MAX_THROTTLED_RETRIES = 3
+    MAX_RETRY_DELAY = 60 * 5
+
+    def __init__(self, client):
+        self.client = client
+        self._requests = {}
+        self._schedule = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._workers = ThreadPoolExecutor(max_workers=client.jobs, thread_name_prefix="bgg-request")
+
+    def submit(self, url, params, requester=None, reuse=True):
+        """
+        Returns the future for url and params, scheduling the request if it is new.
+
+        Args:
+            requester: Session to make the request with instead of the client's default.
+            reuse: Keep the future once the request is done, so submitting the same request
+                again returns it. Otherwise it is only shared while the request is running.
+        """
+        key = (url, tuple(sorted(params.items())), requester)
+        with self._condition:
+            if key in self._requests:
+                return self._requests[key]["future"]
+
+            request = {
+                "key": key,
+                "url": url,
+                "params": params,
+                "requester": requester,
+                "reuse": reuse,
+                "future": Future(),
+                "submitted": time.monotonic(),
+                "polls": 0,
+                "retries": 0,
+            }
+            self._requests[key] = request
+            self._schedule_attempt(request, 0)
+            return request["future"]
+
+    def _schedule_attempt(self, request, delay):
+        """Queues the next attempt at request, must be called holding the condition"""
+        request["due"] = time.monotonic() + delay
+        heapq.heappush(self._schedule, (request["due"], next(self._counter), request))
+        self._condition.notify()
+
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="bgg-request-scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._schedule:
+                        self._thread = None
+                        return
+                    due, _, request = self._schedule[0]
+                    if due <= time.monotonic():
+                        heapq.heappop(self._schedule)
+                        break
+                    self._condition.wait(due - time.monotonic())
+
+            self._workers.submit(self._attempt, request)
+
+    def _attempt(self, request):
+        started = time.monotonic()
+        waited = started - request["submitted"]
+        trace = {} if self.client.tracer.enabled else None
+        try:
+            data = self.client._make_request(
+                request["url"], request["params"], requester=request["requester"], trace=trace
+            )
+        except BGGRequestQueued:
+            self._trace(request, trace, started, "queued")
+            request["polls"] += 1
+            if waited > RequestScheduler.MAX_WAIT:
+                error = BGGException("BGG API request not processed in time, please try again later.")
+                self._finish(request, error=error)
+                return
+            delay = min(RequestScheduler.MAX_INTERVAL, RequestScheduler.FIRST_INTERVAL * 2 ** (request["polls"] - 1))
+            logger.debug(f"BGG queued {request['url']} {request['params']}, polling again in {delay}s")
+            self._retry(request, delay * random.uniform(0.8, 1.2))
+            return
+        except BGGRetryableError as e:
+            self._trace(request, trace, started, "throttled" if isinstance(e, BGGThrottled) else "failed", e)
+            request["retries"] += 1
+            if isinstance(e, BGGThrottled):
+                max_retries = RequestScheduler.MAX_THROTTLED_RETRIES
+                error = BGGThrottled("BGG returned Too Many Requests")
+            else:
+                max_retries = RequestScheduler.MAX_RETRIES
+                error = BGGRetryableError("BGG API closed the connection prematurely, please try again...")
+            if request["retries"] > max_retries:
+                self._finish(request, error=error)
+                return
+            delay = self._retry_delay(e, request["retries"])
+            logger.debug(f"{e}, trying again in {delay:.0f}s")
+            self._retry(request, delay)
+            return
+        except Exception as e:
+            self._trace(request, trace, started, "error", e)
+            self._finish(request, error=e)
+            return
+
+        self._trace(request, trace, started, "ok")
+        if request["polls"]:
+            logger.info(
+                f"Collection request {request['params']} was ready after {waited:.0f}s "
+                f"in BGG's queue ({request['polls'] + 1} polls)"
+            )
+        self._finish(request, data=data)
+
+    def _trace(self, request, trace, started, outcome, error=None):
+        """Records an attempt at request with the tracer, trace being None when tracing is off"""
+        if trace is None:
+            return
+        self.client.tracer.record(
+            "bgg_request",
+            path=request["url"],
+            params=request["params"],
+            outcome=outcome,
+            error=str(error) if error else None,
+            retries=request["retries"],
+            polls=request["polls"],
+            # Time spent waiting for a free worker after the attempt was due
+            queue_wait=round(started - request["due"], 4),
+            # Time since the request was first submitted, including BGG's queue and earlier attempts
+            waited=round(started - request["submitted"], 4),
+            **trace,
+        )
+
+    @staticmethod
+    def _retry_delay(error, retries):
+        """Seconds to wait before retrying, as asked by Retry-After or backing off exponentially"""
+        if error.retry_after is not None:
+            return error.retry_after
+        base = 30 if isinstance(error, BGGThrottled) else 1
+        delay = min(RequestScheduler.MAX_RETRY_DELAY, base * 2 ** (retries - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _retry(self, request, delay):
+        with self._condition:
+            self._schedule_attempt(request, delay)
+
+    def _finish(self, request, data=None, error=None):
+        if not request["reuse"]:
+            with self._condition:
+                self._requests.pop(request["key"], None)
+        if error is not None:
+            request["future"].set_exception(error)
+        else:
+            request["future"].set_result(data)
+
+class BGGException(Exception):
+    pass
+
+class BGGRequestQueued(BGGException):
+    """BGG accepted the request but has not prepared the response yet"""
+    pass
+
+class BGGRetryableError(BGGException):
+    """The request failed in a way that may succeed when tried again later"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BGGThrottled(BGGRetryableError):
+    """BGG answered with Too Many Requests"""
+    pass
+
+
+# BGG answers with these documents, often with status 200, when there is no real payload yet
+UNCACHEABLE_ROOT_TAGS = (b"message", b"errors", b"error")
+ROOT_TAG_PATTERN = re.compile(rb"<([A-Za-z_][\w.:-]*)")
+
+def _link_value(link):
+    return _attribute(link, "value")
+
+def _link_id_inbound(link):
+    return {"id": int(link.get("id")), "inbound": _bool_attribute(link, "inbound")}
+
+def _link_id_name(link):
+    return {"id": int(link.get("id")), "name": _attribute(link, "value")}
+
+def _link_id_name_inbound(link):
+    return {"id": int(link.get("id")), "name": _attribute(link, "value"), "inbound": _bool_attribute(link, "inbound")}
+
+
+# /thing <link> type -> (key in the game dict, converter for one link), in the game dict's key order
+THING_LINKS = {
+    "boardgamecategory": ("categories", _link_value),
+    "boardgamefamily": ("families", _link_id_name),
+    "boardgamemechanic": ("mechanics", _link_value),
+    "boardgameexpansion": ("expansions", _link_id_inbound),
+    "boardgamecompilation": ("contained", _link_id_name_inbound),
+    "boardgameimplementation": ("reimplements", _link_id_name_inbound),
+    "boardgameintegration": ("integrates", _link_id_name_inbound),
+    "boardgamedesigner": ("designers", _link_id_name_inbound),
+    "boardgameartist": ("artists", _link_id_name_inbound),
+    "boardgamepublisher": ("publishers", _link_id_name_inbound),
+    "boardgame": ("basegame", _link_id_name_inbound),
+    "boardgameaccessory": ("accessories", _link_id_inbound),
+}
+
+# Documents are fed to the incremental parser in chunks of this many bytes
+PARSE_CHUNK_SIZE = 64 * 1024
+
+def root_tag(data):
+    """Returns the lowercased name of the root element as bytes, found without parsing the document"""
+    if isinstance(data, str):
+        data = data[:1024].encode("utf-8")
+
+    # The root element is the first tag after the XML declaration and any comments
+    match = ROOT_TAG_PATTERN.search(data, 0, 1024)
+    return match.group(1).lower() if match else None
+
+def is_cacheable_response(response_data):
+    """Only cache real payloads, never BGG's queued-request messages or error documents"""
+    return root_tag(response_data) not in UNCACHEABLE_ROOT_TAGS
+
+def raise_for_envelope(tree, url):
+    """Raises if tree is BGG's queued-request message or an errors document"""
+    if tree.tag == "message" and tree.text and "Your request for this collection has been accepted" in tree.text:
+        # Waiting is left to the caller, see RequestScheduler
+        raise BGGRequestQueued(f"BGG queued the request for {url}")
+
+    if tree.tag == "errors":
+        raise BGGException(
+            f"BGG returned errors while requesting {url} - " +
+            str([subnode.text for node in tree for subnode in node])
+        )
+
+def iter_items(data, root, item, attributes=None):
+    """
+    Yields the item children of a root document one at a time, as the parser reaches them.
+
+    Each element is cleared and dropped from the tree once the caller moves on, so only
+    the element being handled is ever held as a tree, however large the document. The
+    message/errors envelope is recognised from the first element.
+
+    Args:
+        attributes (dict, optional): Receives the attributes of the root element, e.g. the total of /plays.
+
+    Raises:
+        BGGRequestQueued, BGGException: If the document is not a root document.
+        ParseError: If the document is not well-formed.
+    """
+    # Slices of a memoryview are fed without copying the body
+    view = memoryview(data) if isinstance(data, bytes) else data
+    parser = XMLPullParser(events=("start", "end"))
+    document = None
+    depth = 0
+    for offset in range(0, len(data), PARSE_CHUNK_SIZE):
+        parser.feed(view[offset:offset + PARSE_CHUNK_SIZE])
+        for event, element in parser.read_events():
+            if event == "start":
+                depth += 1
+                if document is None:
+                    document = element
+                    if attributes is not None:
+                        attributes.update(document.attrib)
+                    if document.tag != root:
+                        # Envelopes are tiny, parse the rest before looking inside
+                        parser.feed(view[offset + PARSE_CHUNK_SIZE:])
+                        parser.close()
+                        raise_for_envelope(document, f"<{root}>")
+                        raise BGGException(f"Expected a <{root}> document, BGG returned <{document.tag}>")
+                continue
+
+            depth -= 1
+            if depth == 1:
+                if element.tag == item:
+                    yield element
+                element.clear()
+                document.remove(element)
+    parser.close()
+
+def _text(element, default=""):
+    """Stripped text of an element that may be missing, like declxml's string()"""
+    if element is None:
+        return default
+    return element.text.strip() if element.text else ""
+
+def _attribute(element, name, default=""):
+    """Stripped attribute of an element that may be missing, like declxml's string(attribute=...)"""
+    value = element.get(name) if element is not None else None
+    return default if value is None else value.strip()
+
+def _int_text(element, default=0):
+    """Integer text of an element that may be missing, like declxml's integer()"""
+    return default if element is None else int(element.text)
+
+def _bool_attribute(element, name, default=False):
+    """Boolean attribute of an element that may be missing, like declxml's boolean(attribute=...)"""
+    value = element.get(name) if element is not None else None
+    if value is None:
+        return default
+    if value.lower() not in ("true", "false"):
+        raise ValueError(f"Invalid boolean value {value!r}")
+    return value.lower() == "true"
+
+def _int_attribute(element, name, default=0):
+    """Integer attribute of an element that may be missing, like declxml's integer(attribute=...)"""
+    value = element.get(name) if element is not None else None
+    return default if value is None else int(value)
+
+def prettify_if_xml(xml_string):
+    import xml.dom.minidom
+    import re
+    xml_string = re.sub(r"\s+<", "<", re.sub(r">\s+", ">", re.sub(r"\s+", " ", xml_string)))
+    if not xml_string.startswith("<?xml"):
+        return xml_string
+
+    parsed = xml.dom.minidom.parseString(xml_string)
+    return parsed.toprettyxml()
@@ -0,0 +1,158 @@
+"""
+Cache maintenance functionality for GameCache project.
+Keeps the SQLite cache file bounded by sweeping expired entries, evicting the least
+recently used ones above a size cap and handing freed pages back to the filesystem.
+"""
+
+import logging
+import os
+import threading
+import time as time_module
+
+from .http_client import CacheDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMaintainer:
+    """Expiry sweeping, LRU eviction and compaction for the tables of one cache file"""
+
+    # Rows deleted per step while evicting down to max_size_mb
+    EVICT_BATCH = 200
+
+    def __init__(self, path, tables, max_size_mb=None, interval=600):
+        """
+        Args:
+            path: Path of the cache database
+            tables: Dict of table name to the seconds its rows stay useful. Every table needs
+                timestamp and last_access columns, tables missing from the file are skipped.
+            max_size_mb: Size the live data is evicted down to, least recently used first (None for no cap)
+            interval: Seconds between background maintenance passes
+        """
+        self.path = path
+        self.max_size_mb = max_size_mb
+        self.interval = interval
+        self.db = CacheDatabase.for_path(path)
+
+        existing = {row[0] for row in self.db.read("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.tables = {table: expire_after for table, expire_after in tables.items() if table in existing}
+        for table in self.tables:
+            # Files written before LRU tracking count rows as last accessed when stored
+            self.db.add_columns(table, {"last_access": "REAL"})
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Runs a maintenance pass now, and again every interval seconds, on a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="cache-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background passes, waiting for a running one to finish"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                # Maintenance is best effort, the cache works fine without it
+                logger.warning(f"Maintenance of {self.path} failed: {e}")
+            self._stop.wait(self.interval)
+
+    def maintain(self):
+        """Sweeps expired rows, evicts down to the size cap and compacts. Returns the rows removed."""
+        expired = self.sweep_expired()
+        evicted = self.evict(self.max_size_mb) if self.max_size_mb else 0
+        if expired or evicted:
+            self.compact()
+            logger.info(f"Cache maintenance removed {expired} expired and {evicted} evicted entries from {self.path}")
+        return expired + evicted
+
+    def sweep_expired(self):
+        """Deletes every row older than its table's lifetime, returning the number deleted"""
+        def sweep(conn):
+            now = time_module.time()
+            return sum(
+                conn.execute(f"DELETE FROM {table} WHERE timestamp < ?", (now - expire_after,)).rowcount
+                for table, expire_after in self.tables.items()
+            )
+        return self.db.run(sweep).result()
+
+    def evict(self, max_size_mb):
+        """Deletes least recently used rows until the live data fits max_size_mb, returning the number deleted"""
+        if not self.tables:
+            return 0
+        max_bytes = max_size_mb * 1024 * 1024
+        lru = " UNION ALL ".join(
+            f"SELECT '{table}', rowid, COALESCE(last_access, timestamp) AS accessed FROM {table}"
+            for table in self.tables
+        )
+
+        def evict_rows(conn):
+            evicted = 0
+            while _live_bytes(conn) > max_bytes:
+                rows = conn.execute(f"{lru} ORDER BY accessed LIMIT ?", (self.EVICT_BATCH,)).fetchall()
+                if not rows:
+                    break
+                for table, rowid, _ in rows:
+                    conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+                evicted += len(rows)
+            return evicted
+        return self.db.run(evict_rows).result()
+
+    def compact(self, full=False):
+        """
+        Returns free pages to the filesystem.
+
+        Files created before incremental auto-vacuum was enabled are converted by a full
+        VACUUM, once. After that freeing pages is cheap, full=True still forces a VACUUM
+        to defragment the file.
+        """
+        def vacuum(conn):
+            if full or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            else:
+                # execute() steps the pragma once, freeing a single page, executescript() runs it to the end
+                conn.executescript("PRAGMA incremental_vacuum;")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        self.db.run(vacuum).result()
+
+    def stats(self):
+        """Returns a dict describing the cache file and, per table, its rows"""
+        def collect(conn):
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            now = time_module.time()
+            tables = {}
+            for table, expire_after in self.tables.items():
+                rows, expired, oldest_access = conn.execute(
+                    f"SELECT COUNT(*), SUM(timestamp < ?), MIN(COALESCE(last_access, timestamp)) FROM {table}",
+                    (now - expire_after,)
+                ).fetchone()
+                tables[table] = {
+                    "rows": rows,
+                    "expired": expired or 0,
+                    "oldest_access": oldest_access,
+                }
+            return {
+                "file_bytes": sum(
+                    os.path.getsize(path) for path in (self.path, f"{self.path}-wal") if os.path.exists(path)
+                ),
+                "live_bytes": _live_bytes(conn),
+                "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+                "tables": tables,
+            }
+        return self.db.run(collect).result()
+
+
+def _live_bytes(conn):
+    """Bytes of the database pages that are in use"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - freelist_count) * page_size
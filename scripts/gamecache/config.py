@@ -4,6 +4,9 @@ Configuration parsing utilities for GameCache project.
 
 from pathlib import Path
 
+# Collection statuses BGG tags items with, and that bgg_statuses may list
+BGG_STATUSES = ["own", "preordered", "wishlist", "prevowned", "want", "wanttoplay", "wanttobuy", "fortrade"]
+
 
 def parse_config_file(config_path="config.txt"):
     """Parse simple key=value config file"""
@@ -55,9 +58,30 @@ def create_nested_config(config):
         },
         "boardgamegeek": {
             "user_name": config["bgg_username"],
-            "token": config["token"]
+            "token": config["token"],
+            # Optional comma separated collection statuses, e.g. own, preordered, wishlist
+            "statuses": parse_statuses(config["bgg_statuses"]) if "bgg_statuses" in config else None
         },
         "github": {
             "repo": config["github_repo"]
         }
     }
+
+
+def parse_list(value):
+    """Split a comma separated config value into its non-empty items"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_statuses(value):
+    """
+    Split a comma separated bgg_statuses value, rejecting unknown statuses.
+
+    BGG ignores filters it doesn't know, so a typo would otherwise download the whole
+    collection only for every item to be filtered out.
+    """
+    statuses = parse_list(value)
+    unknown = [status for status in statuses if status not in BGG_STATUSES]
+    if unknown:
+        raise ValueError(f"Unknown bgg_statuses {', '.join(unknown)}, expected any of {', '.join(BGG_STATUSES)}")
+    return statuses
@@ -1,97 +1,282 @@
 import copy
 import itertools
+import json
+import logging
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from gamecache.bgg_client import BGGClient
-from gamecache.bgg_client import CacheBackendSqlite
+from gamecache.bgg_client import CacheBackendSqlite, ThingCache
+from gamecache.cache_maintenance import CacheMaintainer
+from gamecache.http_client import CachePolicy
 from gamecache.models import BoardGame
+from gamecache.sync_store import SyncStore
+from gamecache.tracing import Tracer
 
 from datetime import datetime
 from multidict import MultiDict
 
+logger = logging.getLogger(__name__)
+
 DATE_FORMAT = "%Y-%m-%d"
 
 EXTRA_EXPANSIONS_GAME_ID=81913
 UNPUBLISHED_PROTOTYPE=18291
 BOX_OF_PROMOS=39378
 
+# BGG's lastmodified times are in server time, so ask for a generous overlap
+SYNC_OVERLAP = 60 * 60 * 24
+MODIFIED_SINCE_FORMAT = "%y-%m-%d %H:%M:%S"
+# How long the details of unchanged collection items are reused in incremental mode
+UNCHANGED_THING_TTL = 60 * 60 * 24 * 7
+# Collection statuses downloaded when config.ini doesn't set bgg_statuses
+DEFAULT_STATUSES = ["own", "preordered", "wishlist"]
+# /collection filter parameter for status tags whose name differs from it
+STATUS_FILTER_PARAMS = {"fortrade": "trade"}
+
+# Incremental plays syncs ask for plays dated since the last sync minus this, so plays
+# logged up to two weeks after they were played are still picked up
+PLAYS_SYNC_OVERLAP = 60 * 60 * 24 * 14
+# Deleted and edited plays, and plays logged even later, only show up in a full plays sync
+PLAYS_FULL_SYNC_INTERVAL = 60 * 60 * 24 * 7
+
+CACHE_PATH = "gamecache-cache.sqlite"
+# Request rate and concurrency BGG tolerated in earlier runs, kept with the cache
+RATE_STATE_PATH = "gamecache-rate.json"
+CACHE_TTL = 60 * 60 * 24
+# Game details and statistics move slowly, they are cached per game rather than per URL
+THING_TTL = 60 * 60 * 24 * 3
+
+# The first policy matching a cached URL decides how long it is fresh. Collections and plays
+# change between hourly runs, so they are refreshed every run but answered from the cache
+# straight away while the refresh runs in the background.
+CACHE_POLICIES = [
+    CachePolicy(r"/xmlapi2/collection\?", ttl=60 * 60, stale_while_revalidate=60 * 60 * 3),
+    CachePolicy(r"/xmlapi2/plays\?", ttl=60 * 60, stale_while_revalidate=60 * 60 * 3),
+    CachePolicy(r"/xmlapi2/thing/?\?", ttl=THING_TTL),
+    # Image URLs carry the image hash, their bytes never change
+    CachePolicy(r"^https://cf\.geekdo-images\.com/", ttl=60 * 60 * 24 * 30),
+]
+
+# Seconds the rows of every table in the cache file stay useful
+CACHE_TABLES = {
+    "http_cache": max([CACHE_TTL] + [policy.lifetime for policy in CACHE_POLICIES]),
+    "thing_cache": max(THING_TTL, UNCHANGED_THING_TTL),
+}
+
 class Downloader():
-    def __init__(self, cache_bgg, token, debug=False):
+    def __init__(self, cache_bgg, token, debug=False, jobs=BGGClient.DEFAULT_JOBS, incremental=False,
+                 cache_max_mb=None, shared_rate_limit=None, trace_path=None):
+        self.sync_store = None
+        if incremental:
+            self.sync_store = SyncStore(path="gamecache-sync.sqlite")
+
         if cache_bgg:
             self.client = BGGClient(
                 cache=CacheBackendSqlite(
-                    path=f"gamecache-cache.sqlite",
-                    ttl=60 * 60 * 24,
+                    path=CACHE_PATH,
+                    ttl=CACHE_TTL,
+                    policies=CACHE_POLICIES,
+                    thing_ttl=THING_TTL,
                 ),
                 token=token,
                 debug=debug,
+                jobs=jobs,
+                rate_state_path=RATE_STATE_PATH,
+                shared_rate_limit=shared_rate_limit,
+                tracer=Tracer(trace_path),
             )
         else:
             self.client = BGGClient(
                 token=token,
                 debug=debug,
+                jobs=jobs,
+                rate_state_path=RATE_STATE_PATH if incremental else None,
+                shared_rate_limit=shared_rate_limit,
+                tracer=Tracer(trace_path),
+                # Incremental runs reuse details of unchanged items, even without the HTTP cache
+                thing_cache=ThingCache(
+                    cache_name=CACHE_PATH,
+                    expire_after=THING_TTL,
+                ) if incremental else None,
             )
 
-    def collection(self, user_name, extra_params):
-        collection_data = []
-        plays_data = []
-
-        print("Retrieving collection")
-        if isinstance(extra_params, list):
-            for params in extra_params:
-                collection_data += self.client.collection(
-                    user_name=user_name,
-                    **params,
+        self.cache_maintainer = None
+        if cache_bgg or incremental:
+            self.cache_maintainer = CacheMaintainer(
+                CACHE_PATH,
+                tables=CACHE_TABLES,
+                max_size_mb=cache_max_mb,
+            )
+            self.cache_maintainer.start()
+
+    def _collection(self, user_name, params, syncs, unchanged_ids):
+        """
+        Retrieves one collection request.
+
+        In incremental mode only items modified since the last sync are downloaded and merged
+        with the stored items, dropping any that are no longer in the collection. The items to
+        store are appended to syncs, and the ids of items that did not change to unchanged_ids.
+        """
+        if not self.sync_store:
+            return self.client.collection(user_name=user_name, **params)
+
+        sync_key = json.dumps({"user_name": user_name, **params}, sort_keys=True)
+        started = time.time()
+        last_sync = self.sync_store.last_sync(sync_key)
+        stored = self.sync_store.collection(sync_key)
+
+        items = None
+        if last_sync is not None:
+            modified_since = datetime.fromtimestamp(last_sync - SYNC_OVERLAP).strftime(MODIFIED_SINCE_FORMAT)
+            # Fire both before waiting on either, so BGG queues them together
+            self.client.prime_collection(user_name, modifiedsince=modified_since, **params)
+            current_ids = set(self.client.collection_ids(user_name=user_name, **params))
+            modified = self.client.collection(user_name=user_name, modifiedsince=modified_since, **params)
+            merged = {collection_id: item for collection_id, item in stored.items() if collection_id in current_ids}
+            merged.update((item["collection_id"], item) for item in modified)
+
+            # Anything we can't account for means the stored state is unusable
+            if current_ids <= merged.keys():
+                items = [item for collection_id, item in merged.items() if collection_id in current_ids]
+                modified_ids = {item["id"] for item in modified}
+                unchanged_ids.update(item["id"] for item in items if item["id"] not in modified_ids)
+                print(
+                    f"Incremental sync: {len(modified)} changed, "
+                    f"{len(stored.keys() - current_ids)} removed, {len(items)} total"
                 )
+
+        if items is None:
+            items = self.client.collection(user_name=user_name, **params)
+
+        syncs.append((sync_key, started, copy.deepcopy(items)))
+        return items
+
+    def _play_aggregates(self, user_name):
+        """
+        Returns the players and first and last played dates of every game user_name logged plays of.
+
+        In incremental mode the aggregates are stored, and only plays dated since the last sync
+        are downloaded and folded into them, with a full download every PLAYS_FULL_SYNC_INTERVAL.
+        """
+        # Pages are folded in as they arrive rather than collected first
+        if not self.sync_store:
+            return aggregate_plays(self.client.iter_plays(user_name=user_name))
+
+        started = time.time()
+        last_sync, last_full_sync = self.sync_store.plays_sync(user_name)
+        full = last_sync is None or last_full_sync is None or started - last_full_sync > PLAYS_FULL_SYNC_INTERVAL
+        if full:
+            aggregates = aggregate_plays(self.client.iter_plays(user_name=user_name))
         else:
-            collection_data = self.client.collection(
-                user_name=user_name,
-                **extra_params,
+            mindate = datetime.fromtimestamp(last_sync - PLAYS_SYNC_OVERLAP).strftime(DATE_FORMAT)
+            plays = self.client.plays(user_name=user_name, mindate=mindate)
+            aggregates = aggregate_plays(plays, self.sync_store.play_aggregates(user_name))
+            print(f"Incremental plays sync: {len(plays)} plays since {mindate}")
+
+        # Aggregates don't depend on the collection, so they can be stored straight away
+        self.sync_store.save_play_aggregates(user_name, started, aggregates, full=full)
+        return aggregates
+
+    def _collections(self, user_name, param_sets, syncs, unchanged_ids):
+        """Retrieves the collection for every set of params side by side, merging the items by collection_id"""
+        with ThreadPoolExecutor(max_workers=len(param_sets)) as executor:
+            results = list(executor.map(
+                lambda params: self._collection(user_name, params, syncs, unchanged_ids),
+                param_sets
+            ))
+
+        merged = {}
+        for items in results:
+            for item in items:
+                merged.setdefault(item["collection_id"], item)
+        return list(merged.values())
+
+    def collection(self, user_name, extra_params, statuses=DEFAULT_STATUSES):
+        """
+        Downloads the collection, accessories and plays of user_name and assembles the games.
+
+        Args:
+            extra_params (dict or list): Extra /collection parameters, or a list of them.
+            statuses (list): Status tags an item needs one of to be included, e.g. own. Each is
+                requested from BGG separately, so only those items are downloaded. Empty for the
+                whole collection.
+        """
+        syncs = []
+        unchanged_ids = set()
+        accessory_params = {"subtype": "boardgameaccessory"}
+
+        # BGG combines status filters with AND, so every status is a request of its own
+        status_filters = [{STATUS_FILTER_PARAMS.get(status, status): 1} for status in statuses] or [{}]
+        base_params = extra_params if isinstance(extra_params, list) else [extra_params]
+        collection_params = [{**params, **status_filter} for params in base_params for status_filter in status_filters]
+        accessory_collection_params = [{**accessory_params, **status_filter} for status_filter in status_filters]
+
+        if not self.sync_store:
+            # Get every collection request into BGG's queue before waiting on any of them
+            for params in collection_params + accessory_collection_params:
+                self.client.prime_collection(user_name, **params)
+
+        # The three downloads are independent and each can wait in BGG's queue for a
+        # while, so run them side by side and only join before assembling the games
+        print("Retrieving collection, accessories and plays")
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            collection_future = executor.submit(self._collections, user_name, collection_params, syncs, unchanged_ids)
+            accessory_future = executor.submit(
+                self._collections, user_name, accessory_collection_params, syncs, unchanged_ids
             )
+            plays_future = executor.submit(self._play_aggregates, user_name)
+
+            collection_data = collection_future.result()
+            accessory_collection = accessory_future.result()
+            play_aggregates = plays_future.result()
 
-        # Filter collection to the types we're interested in
-        # TODO Externalize this
-        filtered_tags = ['own', 'preordered', 'wishlist']
-        collection_data = list(filter(lambda item: any(tag in filtered_tags for tag in item.get("tags", [])), collection_data))
+        # BGG already filtered by status, this only guards against it ignoring a filter
+        if statuses:
+            collection_data = list(filter(
+                lambda item: any(tag in statuses for tag in item.get("tags", [])), collection_data
+            ))
 
         # Dummy game for linking extra promos and accessories
         collection_data.append(_create_blank_collection(EXTRA_EXPANSIONS_GAME_ID, "ZZZ: Expansions without Game"))
 
-        print("Begin retrieving accessory details")
-        params = {"subtype": "boardgameaccessory"}
-        accessory_collection = self.client.collection(user_name=user_name, **params)
-        accessory_collection = list(filter(lambda item: any(tag in filtered_tags for tag in item.get("tags", [])), accessory_collection))
+        if statuses:
+            accessory_collection = list(filter(
+                lambda item: any(tag in statuses for tag in item.get("tags", [])), accessory_collection
+            ))
 
-        accessory_list_data = self.client.game_list([game_in_collection["id"] for game_in_collection in accessory_collection])
         accessory_collection_by_id = MultiDict()
         for acc in accessory_collection:
             accessory_collection_by_id.add(str(acc["id"]), acc)
 
-        plays_data = self.client.plays(
-            user_name=user_name,
+        # Plan every /thing lookup at once so ids shared between accessories, games
+        # and their related items are only downloaded once, in full batches
+        print("Begin retrieving game and accessory details")
+        accessory_list_data, game_list_data = self.client.game_lists(
+            [game_in_collection["id"] for game_in_collection in accessory_collection],
+            [game_in_collection["id"] for game_in_collection in collection_data],
+            unchanged_ids=unchanged_ids,
+            unchanged_ttl=UNCHANGED_THING_TTL,
         )
+        if hasattr(self.client.requester, "stats"):
+            logger.debug(f"BGG cache hits and misses per tier: {self.client.requester.stats()}")
 
-        print("Begin retrieving game details")
-        game_list_data = self.client.game_list([game_in_collection["id"] for game_in_collection in collection_data])
+        # Everything needed from BGG has been downloaded, so this sync is complete
+        for sync_key, started, items in syncs:
+            self.sync_store.save(sync_key, started, items)
 
         collection_by_id = MultiDict();
         for item in collection_data:
             item["players"] = []
             collection_by_id.add(str(item["id"]), item)
 
-        for play in plays_data:
-            play_id = str(play["game"]["gameid"])
+        for game_id, aggregate in play_aggregates.items():
+            play_id = str(game_id)
             if play_id in collection_by_id:
-                play_date = datetime.strptime(play["played_date"], DATE_FORMAT)
-                collection_by_id[play_id]["players"].extend(play["players"])
-
-                current_last_played = collection_by_id[play_id].get("last_played")
-                if current_last_played is None or play_date > current_last_played:
-                    collection_by_id[play_id]["last_played"] = play_date
-
-                current_first_played = collection_by_id[play_id].get("first_played")
-                if current_first_played is None or play_date < current_first_played:
-                    collection_by_id[play_id]["first_played"] = play_date
+                collection_by_id[play_id]["players"] = sorted(aggregate["players"])
+                collection_by_id[play_id]["last_played"] = datetime.strptime(aggregate["last_played"], DATE_FORMAT)
+                collection_by_id[play_id]["first_played"] = datetime.strptime(aggregate["first_played"], DATE_FORMAT)
 
         games_data = list(filter(lambda x: x["type"] == "boardgame", game_list_data))
         expansions_data = list(filter(lambda x: x["type"] == "boardgameexpansion", game_list_data))
@@ -261,6 +446,36 @@ class Downloader():
 
         return games
 
+def aggregate_plays(plays, aggregates=None):
+    """
+    Folds plays into per-game aggregates of the players and the first and last played dates.
+
+    Dates stay YYYY-MM-DD strings, which order like the dates they are. Folding in the same
+    play twice changes nothing, so downloads that overlap earlier ones are harmless.
+
+    Args:
+        plays (iterable): Plays as yielded by BGGClient.iter_plays.
+        aggregates (dict, optional): Aggregates by game id to update in place.
+
+    Returns:
+        dict: Game id to a dict of its players (a set), first_played and last_played.
+    """
+    aggregates = {} if aggregates is None else aggregates
+    for play in plays:
+        played_date = play["played_date"]
+        aggregate = aggregates.get(play["game"]["gameid"])
+        if aggregate is None:
+            aggregates[play["game"]["gameid"]] = {
+                "players": set(play["players"]),
+                "first_played": played_date,
+                "last_played": played_date,
+            }
+        else:
+            aggregate["players"].update(play["players"])
+            aggregate["first_played"] = min(aggregate["first_played"], played_date)
+            aggregate["last_played"] = max(aggregate["last_played"], played_date)
+    return aggregates
+
 def get_name(obj):
     # Try to get name as attribute, fallback to dict key
     if hasattr(obj, 'name'):
@@ -6,46 +6,228 @@ Provides simple HTTP functionality with caching capabilities.
 import urllib.request
 import urllib.parse
 import urllib.error
+import http.client
+import atexit
+import io
 import json
+import logging
+import os
+import queue
+import re
 import sqlite3
 import hashlib
+import ssl
+import threading
 import time as time_module
 import gzip
+import zlib
+import email.utils
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent http.client connections, kept per scheme, host and port"""
+
+    # Errors that mean a kept-alive connection was closed by the server while idle
+    STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+    # Requests safe to send again when that happens. The server may have acted on the others, e.g. a POST
+    # creating a GitHub release, before the connection dropped.
+    RETRYABLE_METHODS = ("GET", "HEAD")
+
+    def __init__(self, max_idle_per_host=8, idle_timeout=30):
+        """
+        Args:
+            max_idle_per_host: Idle connections kept per host, extra ones are closed
+            idle_timeout: Seconds an idle connection is trusted before it is discarded
+        """
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    def _acquire(self, key, timeout):
+        """Returns an idle connection for key, or a new one, and whether it was reused"""
+        scheme, host, port = key
+        now = time_module.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    conn.timeout = timeout
+                    if conn.sock:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time_module.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=30):
+        """
+        Sends a single request over a pooled connection, without following redirects.
+
+        Returns:
+            tuple: (body bytes, status code, response headers)
+        """
+        parsed = urllib.parse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except self.STALE_CONNECTION_ERRORS as e:
+                conn.close()
+                if reused and method in self.RETRYABLE_METHODS:
+                    # Try again on a fresh connection
+                    continue
+                raise urllib.error.URLError(e)
+            except OSError as e:
+                conn.close()
+                raise urllib.error.URLError(e)
+            except Exception:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return data, response.status, response.headers
+
+
+_pool = ConnectionPool()
+
+
+class HttpRequestError(Exception):
+    """A failed request, with the HTTP status and Retry-After delay when the server sent them"""
+
+    def __init__(self, message, status_code=None, retry_after=None, elapsed=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        # Seconds the failed network call took, not counting the wait for a rate limit token
+        self.elapsed = elapsed
+
+    @classmethod
+    def wrap(cls, e, elapsed=None):
+        """Re-raises e with the "HTTP request failed" prefix, keeping its status and Retry-After"""
+        return cls(
+            f"HTTP request failed: {e}",
+            getattr(e, "status_code", None),
+            getattr(e, "retry_after", None),
+            elapsed if elapsed is not None else getattr(e, "elapsed", None),
+        )
+
+
+def parse_retry_after(value):
+    """Returns the seconds a Retry-After header asks to wait, for both the delay and the date form"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time_module.time())
+
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+def _send(url, method='GET', data=None, headers=None, timeout=30, max_redirects=5):
+    """
+    Send a request over the shared connection pool, mimicking urllib.request.urlopen.
+
+    GET and HEAD redirects are followed. Any other non-2xx answer raises urllib.error.HTTPError,
+    so callers can keep handling errors the way they did with urlopen.
+
+    Returns:
+        tuple: (body bytes, status code, response headers), with gzip bodies decompressed
+    """
+    headers = dict(headers or {})
+    if data is not None and not any(key.lower() == 'content-type' for key in headers):
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    # Proxies are left to urllib, which knows how to talk to them
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parsed.hostname):
+        request = urllib.request.Request(url, data=data, headers=headers, method=method)
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            if response.info().get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            return body, response.code, response.headers
+
+    for _ in range(max_redirects + 1):
+        body, status, response_headers = _pool.request(method, url, data, headers, timeout)
+
+        if response_headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        if status in REDIRECT_CODES and method in ('GET', 'HEAD') and response_headers.get('Location'):
+            url = urllib.parse.urljoin(url, response_headers['Location'])
+            continue
+
+        if not 200 <= status < 300:
+            raise urllib.error.HTTPError(url, status, http.client.responses.get(status, ''),
+                                         response_headers, io.BytesIO(body))
+        return body, status, response_headers
+
+    raise urllib.error.HTTPError(url, status, f"Too many redirects ({max_redirects})",
+                                 response_headers, io.BytesIO(body))
 
 
 def make_http_request(url, params=None, timeout=30, headers=None):
-    """Simple HTTP GET using urllib"""
+    """Simple HTTP GET over the shared keep-alive connection pool"""
     try:
         # URL encode params and add to URL
         if params:
             query_string = urllib.parse.urlencode(params)
             url += "?" + query_string
 
-        # Create request with proper headers
-        request = urllib.request.Request(url)
-        request.add_header('Accept-Encoding', 'gzip, deflate')
-        request.add_header('User-Agent', 'GameCache/1.0')
+        request_headers = {
+            'Accept-Encoding': 'gzip, deflate',
+            'User-Agent': 'GameCache/1.0',
+        }
 
         # Add any additional headers
         if headers:
-            for key, value in headers.items():
-                request.add_header(key, value)
-
-        with urllib.request.urlopen(request, timeout=timeout) as response:
+            request_headers.update(headers)
 
-            data = response.read()
-
-            # Check if response is gzip compressed
-            if response.info().get('Content-Encoding') == 'gzip':
-                data = gzip.decompress(data)
-
-            return (data, response.code)
+        data, code, _ = _send(url, headers=request_headers, timeout=timeout)
+        return (data, code)
+    except urllib.error.HTTPError as e:
+        retry_after = parse_retry_after(e.headers.get('Retry-After')) if e.headers else None
+        raise HttpRequestError(f"HTTP request failed: {e}", e.code, retry_after)
     except urllib.error.URLError as e:
-        raise Exception(f"HTTP request failed: {e}")
+        raise HttpRequestError(f"HTTP request failed: {e}")
 
 
 def make_http_post(url, data=None, headers=None, timeout=30):
-    """Simple HTTP POST using urllib"""
+    """Simple HTTP POST over the shared keep-alive connection pool"""
     if headers is None:
         headers = {}
 
@@ -55,11 +237,9 @@ def make_http_post(url, data=None, headers=None, timeout=30):
     elif isinstance(data, str):
         data = data.encode('utf-8')
 
-    req = urllib.request.Request(url, data=data, headers=headers)
-
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as response:
-            return (response.read(), response.code)
+        response_data, code, _ = _send(url, 'POST', data=data, headers=headers, timeout=timeout)
+        return (response_data, code)
     except urllib.error.URLError as e:
         raise Exception(f"HTTP request failed: {e}")
 
@@ -67,22 +247,41 @@ def make_http_post(url, data=None, headers=None, timeout=30):
 class HttpResponse:
     """Simple response object that mimics requests.Response interface"""
 
-    def __init__(self, content, headers, status_code, from_cache=False, url=None):
+    def __init__(self, content, headers, status_code, from_cache=False, url=None, cache_tier=None, elapsed=None):
         self.content = content
         self.headers = headers
         self.status_code = status_code
         self.from_cache = from_cache
+        # Where a cached response came from: "memory", "disk", or "stale" when served while refreshing
+        self.cache_tier = cache_tier
+        # Seconds the network call took, not counting the wait for a rate limit token (None when cached)
+        self.elapsed = elapsed
         self.url = url or "unknown"
-
-        # For compatibility with existing code
-        if isinstance(content, bytes):
-            # Try to decode as UTF-8, fallback to latin-1 if that fails
-            try:
-                self.text = content.decode('utf-8')
-            except UnicodeDecodeError:
-                self.text = content.decode('latin-1', errors='ignore')
-        else:
-            self.text = str(content)
+        self._text = None
+
+    @property
+    def text(self):
+        """The body as a str, decoded on first use so callers parsing the bytes never pay for it"""
+        if self._text is None:
+            if isinstance(self.content, bytes):
+                # Try to decode as UTF-8, fallback to latin-1 if that fails
+                try:
+                    self._text = self.content.decode('utf-8')
+                except UnicodeDecodeError:
+                    self._text = self.content.decode('latin-1', errors='ignore')
+            else:
+                self._text = str(self.content)
+        return self._text
+
+    @classmethod
+    def from_memory(cls, response):
+        """Returns a copy of a response held in memory, marked as coming from the cache"""
+        copy = cls.__new__(cls)
+        copy.__dict__.update(response.__dict__)
+        copy.from_cache = True
+        copy.cache_tier = "memory"
+        copy.elapsed = None
+        return copy
 
     def raise_for_status(self):
         """Raise an exception for bad status codes (like requests)"""
@@ -93,6 +292,13 @@ class HttpResponse:
 class HttpSession:
     """Simple session-like class that mimics requests.Session interface"""
 
+    def __init__(self, rate_limiter=None):
+        """
+        Args:
+            rate_limiter: Optional limiter whose acquire() is called before every network request
+        """
+        self.rate_limiter = rate_limiter
+
     def get(self, url, params=None, timeout=30, headers={}):
         """GET request that mimics requests.Session.get()"""
         # Build full URL with parameters
@@ -102,24 +308,337 @@ class HttpSession:
         else:
             full_url = url
 
+        sent = None
         try:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            sent = time_module.monotonic()
             response_data, code = make_http_request(full_url, timeout=timeout, headers=headers)
-            return HttpResponse(response_data, {}, code, from_cache=False, url=full_url)
+            return HttpResponse(response_data, {}, code, from_cache=False, url=full_url,
+                                elapsed=time_module.monotonic() - sent)
         except Exception as e:
             # Re-raise with status code info if possible
-            raise Exception(f"HTTP request failed: {e}")
+            raise HttpRequestError.wrap(e, elapsed=time_module.monotonic() - sent if sent else None)
+
+
+class CacheDatabase:
+    """
+    Long-lived access to a SQLite cache file that many threads can share.
+
+    Every thread reads through its own persistent connection, so sqlite3's statement cache
+    keeps queries prepared. Writes are queued to a single writer thread that groups them
+    into one transaction, committed every commit_interval seconds or max_batch writes.
+    The database runs in WAL mode so readers never wait for the writer.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+    _CLOSE = object()
+
+    @classmethod
+    def for_path(cls, path):
+        """Returns the shared instance for path, so every cache on one file uses one writer"""
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+    def __init__(self, path, commit_interval=1.0, max_batch=500):
+        """
+        Args:
+            path: Path of the cache database
+            commit_interval: Longest time in seconds a queued write waits for its commit
+            max_batch: Most writes grouped into one transaction
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self._local = threading.local()
+        self._queue = queue.Queue()
+
+        self._writer_conn = self._connect()
+        self._writer = threading.Thread(target=self._write_loop, name="cache-writer", daemon=True)
+        self._writer.start()
+        # Make sure queued writes reach the disk before the interpreter exits
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # Only takes effect on new files, CacheMaintainer converts existing ones
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def read(self, sql, params=()):
+        """Runs a query on this thread's connection and returns all rows"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn.execute(sql, params).fetchall()
+
+    def write(self, sql, params=()):
+        """Queues a statement for the writer thread"""
+        self._check_writer()
+        self._queue.put((sql, params, False))
+
+    def write_many(self, sql, seq_of_params):
+        """Queues a statement to run once for every set of parameters"""
+        self._check_writer()
+        self._queue.put((sql, list(seq_of_params), True))
+
+    def add_columns(self, table, columns):
+        """Adds every column of the columns dict (name to type) that table is missing"""
+        existing = [row[1] for row in self.read(f"PRAGMA table_info({table})")]
+        for name, column_type in columns.items():
+            if name not in existing:
+                self.write(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+        self.flush()
+
+    def run(self, func):
+        """
+        Runs func(connection) on the writer thread, after committing queued writes.
+
+        Returns a Future with func's result. Changes func makes are committed when it returns.
+        """
+        future = Future()
+        if not self._writer.is_alive():
+            future.set_exception(RuntimeError(f"Cache database {self.path} is closed"))
+            return future
+        self._queue.put((func, future))
+        return future
+
+    def flush(self):
+        """Blocks until every queued write is committed"""
+        self._check_writer()
+        done = threading.Event()
+        self._queue.put(done)
+        # Keep an eye on the writer, nothing would ever set done if it stopped
+        while not done.wait(timeout=self.commit_interval):
+            self._check_writer()
+
+    def _check_writer(self):
+        """Raises instead of queueing work no thread will ever pick up"""
+        if not self._writer.is_alive():
+            raise RuntimeError(f"Cache database {self.path} is closed")
+
+    def close(self):
+        """Commits outstanding writes and stops the writer thread"""
+        if self._writer.is_alive():
+            self._queue.put(self._CLOSE)
+            self._writer.join()
+
+    def _write_loop(self):
+        pending = 0
+        last_commit = time_module.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.commit_interval)
+            except queue.Empty:
+                item = None
+
+            if item is self._CLOSE or isinstance(item, threading.Event):
+                self._commit()
+                pending = 0
+                if item is self._CLOSE:
+                    self._writer_conn.close()
+                    return
+                item.set()
+                continue
+
+            if item and len(item) == 2:
+                func, future = item
+                self._commit()
+                pending = 0
+                try:
+                    result = func(self._writer_conn)
+                    self._writer_conn.commit()
+                    future.set_result(result)
+                except Exception as e:
+                    self._rollback()
+                    future.set_exception(e)
+                last_commit = time_module.monotonic()
+                continue
+
+            if item:
+                sql, params, many = item
+                try:
+                    if many:
+                        self._writer_conn.executemany(sql, params)
+                    else:
+                        self._writer_conn.execute(sql, params)
+                    pending += 1
+                except sqlite3.Error as e:
+                    # A lost cache write only costs a later cache miss
+                    logger.warning(f"Cache write to {self.path} failed: {e}")
+
+            now = time_module.monotonic()
+            if pending and (pending >= self.max_batch or now - last_commit >= self.commit_interval):
+                self._commit()
+                pending = 0
+                last_commit = now
+            elif not pending:
+                last_commit = now
+
+    def _commit(self):
+        """
+        Commits the writes made so far, dropping them if that fails.
+
+        The file may be locked by another run or by manage_cache.py. Losing a batch of cache
+        writes only costs later cache misses, losing the writer thread would hang every flush().
+        """
+        try:
+            self._writer_conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache commit to {self.path} failed, dropping the pending writes: {e}")
+            self._rollback()
+
+    def _rollback(self):
+        try:
+            self._writer_conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache rollback on {self.path} failed: {e}")
+
+
+class ResponseCompressor:
+    """zlib compression for cached bodies, optionally primed with a preset dictionary"""
+
+    def __init__(self, name="zlib", zdict=None, level=6):
+        """
+        Args:
+            name: Stored alongside every body, change it whenever zdict changes
+            zdict: Optional preset dictionary of byte strings common in the bodies
+            level: zlib compression level
+        """
+        self.name = name
+        self.zdict = zdict
+        self.level = level
+
+    def pack(self, data):
+        """Returns (blob, encoding), keeping data as is when compression doesn't make it smaller"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        compressor = zlib.compressobj(self.level, zdict=self.zdict) if self.zdict else zlib.compressobj(self.level)
+        packed = compressor.compress(data) + compressor.flush()
+        if len(packed) < len(data):
+            return packed, self.name
+        return data, None
+
+    def unpack(self, blob, encoding):
+        """Reverses pack(), raising ValueError for encodings this compressor can't read"""
+        if encoding is None:
+            return blob
+        if encoding == self.name and self.zdict:
+            decompressor = zlib.decompressobj(zdict=self.zdict)
+            return decompressor.decompress(blob) + decompressor.flush()
+        if encoding == "zlib":
+            return zlib.decompress(blob)
+        raise ValueError(f"Unknown cache encoding {encoding}")
+
+
+class MemoryCache:
+    """Thread-safe in-memory LRU of responses, bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        """
+        Args:
+            max_entries: Most responses kept
+            max_bytes: Most bytes of response bodies kept
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (response, timestamp) for key and marks it recently used, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def set(self, key, response, timestamp):
+        """Stores response, evicting the least recently used entries that no longer fit"""
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (response, timestamp, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
+
+
+class CachePolicy:
+    """Cache lifetime for the URLs matching a pattern"""
+
+    def __init__(self, pattern, ttl, stale_while_revalidate=0):
+        """
+        Args:
+            pattern: Regular expression searched for in the full URL, parameters included
+            ttl: Seconds a cached response is fresh
+            stale_while_revalidate: Seconds after ttl during which the expired response is still
+                returned straight away, while a fresh copy is downloaded in the background
+        """
+        self.pattern = re.compile(pattern)
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+
+    def matches(self, url):
+        return self.pattern.search(url) is not None
+
+    @property
+    def lifetime(self):
+        """Seconds a cached response stays useful, stale or not"""
+        return self.ttl + self.stale_while_revalidate
 
 
 class CachedHttpClient:
     """HTTP client with SQLite-based caching"""
 
-    def __init__(self, cache_name="http_cache", expire_after=3600):
+    def __init__(self, cache_name="http_cache", expire_after=3600, rate_limiter=None, should_cache=None,
+                 compressor=None, policies=(), memory_cache=None, refresh_via=None):
         """
         Initialize cache with SQLite backend
 
         Args:
             cache_name: Name/path of the cache database
             expire_after: Cache TTL in seconds (default 1 hour)
+            rate_limiter: Optional limiter applied to cache misses only
+            should_cache: Optional callable taking the response body, returning False for
+                responses that must not be cached. Cached entries it rejects are purged on read.
+            compressor: ResponseCompressor for stored bodies (default plain zlib)
+            policies: CachePolicy list, the first one matching a URL decides its lifetime.
+                URLs matching none are fresh for expire_after seconds.
+            memory_cache: MemoryCache checked before the database (default a new MemoryCache).
+                Only fresh responses are served from memory.
+            refresh_via: Optional callable(fetch, url) that background refreshes of stale entries
+                are run through, calling fetch() to download url, so they are paced like other requests
         """
         # Only add .sqlite extension if not already present
         if cache_name.endswith('.sqlite'):
@@ -127,31 +646,98 @@ class CachedHttpClient:
         else:
             self.cache_path = f"{cache_name}.sqlite"
         self.expire_after = expire_after
+        self.rate_limiter = rate_limiter
+        self.refresh_via = refresh_via
+        self.should_cache = should_cache
+        self.compressor = compressor or ResponseCompressor()
+        self.policies = list(policies)
+        self.default_policy = CachePolicy("", expire_after)
+        self.memory = memory_cache or MemoryCache()
+        # Database tier counters, the memory tier keeps its own
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+        self.db = CacheDatabase.for_path(self.cache_path)
         self._init_cache()
 
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresher = None
+
     def _init_cache(self):
         """Initialize the cache database"""
-        conn = sqlite3.connect(self.cache_path)
-        conn.execute("""
+        self.db.write("""
             CREATE TABLE IF NOT EXISTS http_cache (
                 url_hash TEXT PRIMARY KEY,
                 url TEXT,
                 response_data BLOB,
                 headers TEXT,
                 status_code INTEGER,
-                timestamp REAL
+                timestamp REAL,
+                encoding TEXT,
+                last_access REAL
             )
         """)
-        conn.commit()
-        conn.close()
+        self.db.flush()
+
+        # Caches created by older versions lack the newer columns
+        self.db.add_columns("http_cache", {"encoding": "TEXT", "last_access": "REAL"})
+        self.db.write("CREATE INDEX IF NOT EXISTS http_cache_timestamp ON http_cache (timestamp)")
+        self.db.write("CREATE INDEX IF NOT EXISTS http_cache_last_access ON http_cache (last_access)")
+        self.db.flush()
 
     def _get_url_hash(self, url):
         """Generate a hash for the URL to use as cache key"""
         return hashlib.md5(url.encode('utf-8')).hexdigest()
 
-    def _is_expired(self, timestamp):
-        """Check if cache entry is expired"""
-        return time_module.time() - timestamp > self.expire_after
+    def _is_cacheable(self, response_data):
+        """Check the response body against the should_cache hook"""
+        return self.should_cache is None or self.should_cache(response_data)
+
+    def stats(self):
+        """Returns the hit and miss counters of both cache tiers"""
+        with self._counter_lock:
+            database = {"hits": self.hits, "misses": self.misses}
+        return {"memory": self.memory.stats(), "database": database}
+
+    def _count(self, hit):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def policy_for(self, url):
+        """Returns the CachePolicy that applies to url"""
+        return next((policy for policy in self.policies if policy.matches(url)), self.default_policy)
+
+    def _refresh_in_background(self, full_url, url_hash, timeout, headers):
+        """Downloads full_url again on a background thread, unless a refresh of it is already running"""
+        with self._refresh_lock:
+            if url_hash in self._refreshing:
+                return
+            self._refreshing.add(url_hash)
+            if self._refresher is None:
+                # Worker threads are joined at interpreter exit, so refreshes still finish within the run
+                self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+        def fetch():
+            return self._fetch(full_url, url_hash, timeout, headers)
+
+        def refresh():
+            try:
+                if self.refresh_via:
+                    self.refresh_via(fetch, full_url)
+                else:
+                    fetch()
+            except Exception as e:
+                # The stale copy stays in place, the next request tries again
+                logger.debug(f"Background refresh of {full_url} failed: {e}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(url_hash)
+
+        self._refresher.submit(refresh)
 
     def get(self, url, timeout=30, params=None, headers={}):
         """
@@ -173,46 +759,82 @@ class CachedHttpClient:
             full_url = url
 
         url_hash = self._get_url_hash(full_url)
-
-        # Check cache first
-        conn = sqlite3.connect(self.cache_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT response_data, headers, status_code, timestamp FROM http_cache WHERE url_hash = ?",
+        policy = self.policy_for(full_url)
+
+        # Check the memory tier, then the database
+        cached = self.memory.get(url_hash)
+        if cached:
+            response, timestamp = cached
+            if time_module.time() - timestamp <= policy.ttl:
+                return HttpResponse.from_memory(response)
+            # Stale entries are left to the database tier, which knows about revalidation
+            self.memory.discard(url_hash)
+
+        rows = self.db.read(
+            "SELECT response_data, headers, status_code, timestamp, encoding FROM http_cache WHERE url_hash = ?",
             (url_hash,)
         )
-        result = cursor.fetchone()
 
-        if result:
-            response_data, headers_json, status_code, timestamp = result
-            if not self._is_expired(timestamp):
-                # Return cached response
-                conn.close()
-                headers = json.loads(headers_json) if headers_json else {}
-                return HttpResponse(response_data, headers, status_code, from_cache=True, url=full_url)
+        if rows:
+            response_data, headers_json, status_code, timestamp, encoding = rows[0]
+            try:
+                response_data = self.compressor.unpack(response_data, encoding)
+            except (ValueError, zlib.error):
+                response_data = None
+
+            age = time_module.time() - timestamp
+            if response_data is None or not self._is_cacheable(response_data):
+                # Unreadable, or poisoned by an earlier version that cached everything
+                self.db.write("DELETE FROM http_cache WHERE url_hash = ?", (url_hash,))
+            elif age <= policy.lifetime:
+                self._count(hit=True)
+                self.db.write("UPDATE http_cache SET last_access = ? WHERE url_hash = ?",
+                              (time_module.time(), url_hash))
+                cached_headers = json.loads(headers_json) if headers_json else {}
+                response = HttpResponse(response_data, cached_headers, status_code, from_cache=True, url=full_url,
+                                        cache_tier="stale" if age > policy.ttl else "disk")
+                if age > policy.ttl:
+                    # Stale: answer now, and have a fresh copy ready for the next request
+                    self._refresh_in_background(full_url, url_hash, timeout, headers)
+                else:
+                    self.memory.set(url_hash, response, timestamp)
+                return response
 
         # Cache miss or expired - make actual request
+        self._count(hit=False)
+        return self._fetch(full_url, url_hash, timeout, headers)
+
+    def _fetch(self, full_url, url_hash, timeout, headers):
+        """Downloads full_url, storing cacheable responses, and returns the HttpResponse"""
+        sent = None
         try:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            sent = time_module.monotonic()
             response_data, status_code = make_http_request(full_url, timeout=timeout, headers=headers)
+            elapsed = time_module.monotonic() - sent
             # status_code = 200  # make_http_request only returns data on success
             # headers = {}  # Simple implementation doesn't capture headers
 
-            if status_code == 200:
+            if status_code == 200 and self._is_cacheable(response_data):
                 # Store in cache
-                cursor.execute("""
+                blob, encoding = self.compressor.pack(response_data)
+                now = time_module.time()
+                self.db.write("""
                     INSERT OR REPLACE INTO http_cache
-                    (url_hash, url, response_data, headers, status_code, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (url_hash, full_url, response_data, json.dumps(headers), status_code, time_module.time()))
-                conn.commit()
+                    (url_hash, url, response_data, headers, status_code, timestamp, encoding, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (url_hash, full_url, blob, json.dumps(headers), status_code, now, encoding, now))
+                response = HttpResponse(response_data, headers, status_code, from_cache=False, url=full_url,
+                                        elapsed=elapsed)
+                self.memory.set(url_hash, response, now)
+                return response
 
         except Exception as e:
-            conn.close()
             # Re-raise as requests-compatible exception
-            raise Exception(f"HTTP request failed: {e}")
+            raise HttpRequestError.wrap(e, elapsed=time_module.monotonic() - sent if sent else None)
 
-        conn.close()
-        return HttpResponse(response_data, headers, status_code, from_cache=False, url=full_url)
+        return HttpResponse(response_data, headers, status_code, from_cache=False, url=full_url, elapsed=elapsed)
 
 def make_json_request(url, method='GET', data=None, headers=None, timeout=30,
                       _redirects=0, _max_redirects=5):
@@ -242,16 +864,7 @@ def make_json_request(url, method='GET', data=None, headers=None, timeout=30,
                     data = json.dumps(data).encode('utf-8')
                     headers['Content-Type'] = 'application/json'
 
-            # Create request with proper headers
-            request = urllib.request.Request(url, data=data, headers=headers)
-            request.get_method = lambda: method
-
-            with urllib.request.urlopen(request, timeout=timeout) as response:
-                response_data = response.read()
-
-                # Check if response is gzip compressed
-                if response.info().get('Content-Encoding') == 'gzip':
-                    response_data = gzip.decompress(response_data)
+            response_data, _, _ = _send(url, method, data=data, headers=headers, timeout=timeout)
 
         # Parse JSON response
         if response_data:
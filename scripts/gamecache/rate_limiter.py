@@ -0,0 +1,392 @@
+"""
+Rate limiting utilities for GameCache project.
+Provides a thread-safe token bucket that concurrent BGG requests share, optionally
+kept in a file shared by several processes, an AIMD controller that tunes its rate
+and concurrency, and a circuit breaker that pauses all requests while BGG is throttling.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time as time_module
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter"""
+
+    def __init__(self, rate=2.0, capacity=1):
+        """
+        Initialize the bucket full
+
+        Args:
+            rate: Tokens added per second (sustained requests per second)
+            capacity: Maximum number of tokens that can accumulate (burst size)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time_module.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """Changes the sustained rate, keeping the tokens earned at the old rate"""
+        with self._lock:
+            now = time_module.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+
+    def update_rate(self, change):
+        """Sets the rate to change(rate) and returns it, so concurrent changes build on each other"""
+        with self._lock:
+            now = time_module.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = change(self.rate)
+            return self.rate
+
+    def acquire(self):
+        """Block until a token is available, then consume it"""
+        while True:
+            with self._lock:
+                now = time_module.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time_module.sleep(wait)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in a SQLite file, so every process using the file shares one budget.
+
+    Works as a drop-in replacement for TokenBucket. The rate is shared as well, so when
+    one process slows down because BGG throttled it, all of them do.
+    """
+
+    def __init__(self, path, rate=2.0, capacity=1, name="bgg"):
+        """
+        Initialize the bucket full, unless another process already created it
+
+        Args:
+            path: Path of the SQLite file shared by the processes
+            rate: Tokens added per second, when the bucket is new
+            capacity: Maximum number of tokens that can accumulate (burst size)
+            name: Name of the bucket within the file
+        """
+        self.path = path
+        self.capacity = capacity
+        self.name = name
+        self._local = threading.local()
+
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL,
+                    rate REAL,
+                    updated REAL
+                )
+            """)
+            conn.execute(
+                "INSERT OR IGNORE INTO token_buckets (name, tokens, rate, updated) VALUES (?, ?, ?, ?)",
+                (name, float(capacity), rate, time_module.time())
+            )
+            self._rate = conn.execute("SELECT rate FROM token_buckets WHERE name = ?", (name,)).fetchone()[0]
+
+    @property
+    def rate(self):
+        """The shared rate, as of the last time this process used the bucket"""
+        return self._rate
+
+    @contextmanager
+    def _transaction(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        # Take the write lock up front, so no other process can spend the same token
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _refill(self, conn):
+        """Returns (tokens, rate) as of now, saving nothing"""
+        tokens, rate, updated = conn.execute(
+            "SELECT tokens, rate, updated FROM token_buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+        # Wall clock time, the only clock processes share. Never refill for a clock going backwards.
+        elapsed = max(0.0, time_module.time() - updated)
+        return min(self.capacity, tokens + elapsed * rate), rate
+
+    def set_rate(self, rate):
+        """Changes the shared rate, keeping the tokens earned at the old rate"""
+        with self._transaction() as conn:
+            tokens, _ = self._refill(conn)
+            conn.execute(
+                "UPDATE token_buckets SET tokens = ?, rate = ?, updated = ? WHERE name = ?",
+                (tokens, rate, time_module.time(), self.name)
+            )
+        self._rate = rate
+
+    def update_rate(self, change):
+        """
+        Sets the shared rate to change(rate) and returns it.
+
+        The current rate is read and written in one transaction, so a change made by another
+        process in the meantime is built on rather than overwritten.
+        """
+        with self._transaction() as conn:
+            tokens, rate = self._refill(conn)
+            new_rate = change(rate)
+            if new_rate != rate:
+                conn.execute(
+                    "UPDATE token_buckets SET tokens = ?, rate = ?, updated = ? WHERE name = ?",
+                    (tokens, new_rate, time_module.time(), self.name)
+                )
+        self._rate = new_rate
+        return new_rate
+
+    def acquire(self):
+        """Block until a token is available in the shared bucket, then consume it"""
+        while True:
+            with self._transaction() as conn:
+                tokens, self._rate = self._refill(conn)
+                if tokens >= 1:
+                    conn.execute(
+                        "UPDATE token_buckets SET tokens = ?, updated = ? WHERE name = ?",
+                        (tokens - 1, time_module.time(), self.name)
+                    )
+                    return
+
+                wait = (1 - tokens) / self._rate
+
+            time_module.sleep(wait)
+
+
+class CircuitBreaker:
+    """Pauses all requests for a while once the server makes clear it is throttling us"""
+
+    def __init__(self, threshold=3, window=60, cooldown=60):
+        """
+        Args:
+            threshold: Throttled responses within window seconds that open the breaker
+            window: Seconds over which throttled responses are counted
+            cooldown: Seconds requests are paused for once the breaker opens
+        """
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self._throttled = []
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record_throttle(self, retry_after=None):
+        """
+        Counts a throttled response. A Retry-After delay opens the breaker for at least that
+        long straight away, otherwise it opens after threshold throttles within window seconds.
+        """
+        with self._lock:
+            now = time_module.monotonic()
+            self._throttled = [at for at in self._throttled if now - at < self.window] + [now]
+            pause = 0
+            if retry_after:
+                pause = retry_after
+            if len(self._throttled) >= self.threshold:
+                pause = max(pause, self.cooldown)
+                self._throttled = []
+            self._open_until = max(self._open_until, now + pause)
+
+    def record_success(self):
+        with self._lock:
+            self._throttled = []
+
+    def wait(self):
+        """Blocks while the breaker is open"""
+        while True:
+            with self._lock:
+                remaining = self._open_until - time_module.monotonic()
+            if remaining <= 0:
+                return
+            time_module.sleep(remaining)
+
+
+class AdaptiveRateController:
+    """
+    Additive-increase, multiplicative-decrease control of request rate and concurrency.
+
+    While responses come back cleanly the rate grows by about `increase` requests per second,
+    every second, and concurrency by one slot every `concurrency_step` clean responses. A
+    throttled response or a latency spike cuts both multiplicatively. What was learned is
+    saved to state_path, so the next run starts near the sustainable rate.
+    """
+
+    # Seconds after a cut during which further bad news is attributed to the same overload
+    CUT_COOLDOWN = 2.0
+    # A response this many times slower than the average latency counts as a spike
+    SPIKE_FACTOR = 3.0
+    # Responses needed before the average latency is trusted
+    MIN_SAMPLES = 10
+    # Seconds clean responses are counted for before the rate is raised for all of them at once
+    INCREASE_INTERVAL = 1.0
+
+    def __init__(self, bucket, max_concurrency, min_rate=0.2, max_rate=5.0, increase=0.1,
+                 decrease=0.5, concurrency_step=20, state_path=None, state_ttl=60 * 60 * 24 * 7):
+        """
+        Args:
+            bucket: TokenBucket whose rate is controlled
+            max_concurrency: Most requests allowed in flight at once
+            min_rate: Lowest requests per second the rate is cut down to
+            max_rate: Highest requests per second the rate grows to
+            increase: Requests per second added per second of clean responses
+            decrease: Factor the rate is multiplied by when BGG throttles us
+            concurrency_step: Clean responses needed to allow one more request in flight
+            state_path: Optional JSON file the learned rate and concurrency are kept in
+            state_ttl: Seconds a saved state is trusted for
+        """
+        self.bucket = bucket
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.concurrency_step = concurrency_step
+        self.state_path = state_path
+        self.concurrency = max_concurrency
+
+        self._in_flight = 0
+        self._clean = 0
+        self._unrewarded = 0
+        self._last_increase = 0.0
+        self._latency = None
+        self._samples = 0
+        self._last_cut = 0.0
+        self._condition = threading.Condition()
+        self._save_lock = threading.Lock()
+
+        if state_path:
+            self._load(state_ttl)
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    @contextmanager
+    def slot(self):
+        """Holds one of the current concurrency slots for the duration of a request"""
+        with self._condition:
+            while self._in_flight >= self.concurrency:
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def record_success(self, latency):
+        """Counts a clean response that took latency seconds, cutting back if it was a spike"""
+        cut = False
+        clean = 0
+        with self._condition:
+            self._samples += 1
+            if self._latency is not None and self._samples > self.MIN_SAMPLES \
+                    and latency > self.SPIKE_FACTOR * self._latency:
+                self._latency += 0.1 * (latency - self._latency)
+                cut = self._cut(factor=(1 + self.decrease) / 2)
+            else:
+                self._latency = latency if self._latency is None else self._latency + 0.1 * (latency - self._latency)
+
+                self._clean += 1
+                if self._clean >= self.concurrency_step and self.concurrency < self.max_concurrency:
+                    self._clean = 0
+                    self.concurrency += 1
+                    self._condition.notify()
+
+                # Raising the rate is batched, a shared bucket writes every change to its file
+                self._unrewarded += 1
+                now = time_module.monotonic()
+                if now - self._last_increase >= self.INCREASE_INTERVAL:
+                    self._last_increase = now
+                    clean, self._unrewarded = self._unrewarded, 0
+
+        # The bucket is changed outside the lock, so slot() never waits on the shared file
+        if cut:
+            self._slow_down((1 + self.decrease) / 2, f"latency spike of {latency:.1f}s")
+        elif clean:
+            def increased(rate):
+                for _ in range(clean):
+                    if rate >= self.max_rate:
+                        break
+                    rate = min(self.max_rate, rate + self.increase / max(rate, 1.0))
+                return rate
+            self.bucket.update_rate(increased)
+
+    def record_throttle(self):
+        """Counts a response telling us to slow down"""
+        with self._condition:
+            cut = self._cut(factor=self.decrease)
+        if cut:
+            self._slow_down(self.decrease, "throttled")
+
+    def _cut(self, factor):
+        """Cuts concurrency by factor, returning False while an earlier cut is still cooling down"""
+        now = time_module.monotonic()
+        self._clean = 0
+        self._unrewarded = 0
+        if now - self._last_cut < self.CUT_COOLDOWN:
+            return False
+        self._last_cut = now
+        self.concurrency = max(1, int(self.concurrency * factor))
+        return True
+
+    def _slow_down(self, factor, reason):
+        """Cuts the rate by factor after _cut, without holding the lock"""
+        # Cut whatever the shared rate is now, another process may have changed it since we last looked
+        rate = self.bucket.update_rate(lambda rate: max(self.min_rate, rate * factor))
+        logger.debug(f"BGG {reason}, slowing down to {rate:.2f} requests/s with {self.concurrency} in flight")
+        self.save()
+
+    def _load(self, state_ttl):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if time_module.time() - state.get("updated", 0) > state_ttl:
+            return
+        self.bucket.set_rate(min(self.max_rate, max(self.min_rate, state["rate"])))
+        self.concurrency = min(self.max_concurrency, max(1, state["concurrency"]))
+        logger.debug(
+            f"Starting at {self.rate:.2f} requests/s with {self.concurrency} in flight, learned in earlier runs"
+        )
+
+    def save(self):
+        """Writes the learned rate and concurrency to state_path"""
+        if not self.state_path:
+            return
+        state = {"rate": self.rate, "concurrency": self.concurrency, "updated": time_module.time()}
+        try:
+            # Threads cutting at once would otherwise write the same temporary file
+            with self._save_lock:
+                tmp_path = f"{self.state_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Could not save rate state to {self.state_path}: {e}")
@@ -0,0 +1,60 @@
+"""
+Request coalescing utilities for GameCache project.
+Makes sure concurrent workers asking for the same thing share one request.
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time, sharing its result or error with every concurrent caller"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Returns func(), or the result of the call already running for key"""
+        owned, waiting = self.claim([key])
+        if waiting:
+            return waiting[key].result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            self.fail([key], e)
+            raise
+        self.resolve({key: result})
+        return result
+
+    def claim(self, keys):
+        """
+        Claims every key nobody else is working on.
+
+        Returns two dicts of key to Future: the keys now owned by the caller, who must
+        resolve() or fail() each of them, and the keys already in flight elsewhere.
+        """
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                if key in self._calls:
+                    waiting[key] = self._calls[key]
+                elif key not in owned:
+                    owned[key] = self._calls[key] = Future()
+        return owned, waiting
+
+    def resolve(self, results):
+        """Hands a dict of key to result to everyone waiting on those keys"""
+        with self._lock:
+            futures = [(self._calls.pop(key), result) for key, result in results.items()]
+        for future, result in futures:
+            future.set_result(result)
+
+    def fail(self, keys, error):
+        """Hands error to everyone waiting on keys"""
+        with self._lock:
+            futures = [self._calls.pop(key) for key in keys if key in self._calls]
+        for future in futures:
+            future.set_exception(error)
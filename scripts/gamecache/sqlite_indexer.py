@@ -1,4 +1,5 @@
 import sqlite3
+import hashlib
 import json
 import logging
 from typing import List, Dict, Any
@@ -6,9 +7,11 @@ from .models import BoardGame
 import io
 import sys
 import time  # Added for fetch_image retry
+from concurrent.futures import ThreadPoolExecutor
 from .vendor import colorgram
 from PIL import Image, ImageFile
 from .http_client import make_http_request
+from .single_flight import SingleFlight
 from tqdm import tqdm
 
 # Allow colorgram to read truncated files
@@ -19,9 +22,16 @@ logger = logging.getLogger(__name__)
 class SqliteIndexer:
     """SQLite-based indexer to replace Algolia indexer."""
 
-    def __init__(self, db_path: str = "gamecache.sqlite"):
+    def __init__(self, db_path: str = "gamecache.sqlite", incremental: bool = False, image_cache=None,
+                 jobs: int = 4):
         self.db_path = db_path
         self.db_path_gz = f"{db_path}.gz"
+        self.incremental = incremental
+        # Optional CachedHttpClient, so thumbnails are only downloaded once
+        self.image_cache = image_cache
+        # Thumbnails are downloaded by this many workers, each URL only once at a time
+        self.jobs = max(1, jobs)
+        self.image_flights = SingleFlight()
         self._init_database()
 
     def _init_database(self):
@@ -29,6 +39,15 @@ class SqliteIndexer:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
+        if self.incremental:
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(games)')]
+            if 'row_hash' in columns:
+                conn.close()
+                logger.info(f"Reusing SQLite database for incremental update: {self.db_path}")
+                return
+            # No usable previous database, so this run builds it from scratch
+            self.incremental = False
+
         # Drop existing table if it exists
         cursor.execute('DROP TABLE IF EXISTS games')
 
@@ -82,7 +101,8 @@ class SqliteIndexer:
                 version_name TEXT,
                 version_year INTEGER,
                 first_played TEXT,
-                last_played TEXT
+                last_played TEXT,
+                row_hash TEXT           -- Hash of every other column except color, for incremental updates
             )
         ''')
 
@@ -106,14 +126,21 @@ class SqliteIndexer:
         conn.close()
         logger.info(f"Initialized SQLite database: {self.db_path}")
 
-    def fetch_image(self, url, tries=0):  # Copied from indexer.py
+    def fetch_image(self, url):
+        """Downloads url, sharing the download with any worker already fetching the same URL"""
+        return self.image_flights.do(url, lambda: self._fetch_image(url))
+
+    def _fetch_image(self, url, tries=0):  # Copied from indexer.py
         try:
-            response, status = make_http_request(url)
+            if self.image_cache:
+                response = self.image_cache.get(url).content
+            else:
+                response, status = make_http_request(url)
         except Exception as e:
             logger.warning(f"Failed to fetch image {url} (try {tries + 1}): {e}")
             if tries < 2:  # Max 3 tries (0, 1, 2)
                 time.sleep(2)
-                return self.fetch_image(url, tries=tries + 1)
+                return self._fetch_image(url, tries=tries + 1)
             return None  # Return None after max retries
 
         return response
@@ -127,9 +154,20 @@ class SqliteIndexer:
         cursor.execute("PRAGMA journal_mode = WAL")
         cursor.execute("PRAGMA cache_size = -20000")
 
-        # Clear existing data
-        cursor.execute('DELETE FROM games')
+        existing_hashes = {}
+        if self.incremental:
+            # Only rows whose content changed are rewritten, the rest keep their color
+            existing_hashes = dict(cursor.execute('SELECT collection_id, row_hash FROM games'))
+            current_ids = {game.collection_id for game in collection}
+            removed_ids = [(collection_id,) for collection_id in existing_hashes if collection_id not in current_ids]
+            cursor.executemany('DELETE FROM games WHERE collection_id = ?', removed_ids)
+            logger.info(f"Removed {len(removed_ids)} games no longer in the collection")
+        else:
+            # Clear existing data
+            cursor.execute('DELETE FROM games')
 
+        unchanged = 0
+        rows = []
         for game_obj in tqdm(collection, desc="Processing games", total=len(collection)):
             game = game_obj.todict()  # Convert BoardGame object to dictionary
 
@@ -168,51 +206,7 @@ class SqliteIndexer:
             contained_json = json.dumps(game.get('contained', []))
             other_ranks_json = json.dumps(game.get('other_ranks', []))
 
-            color_str = None
-            if game.get("thumbnail"):
-                image_data = self.fetch_image(game["thumbnail"])
-                if image_data:
-                    try:
-                        pil_image = Image.open(io.BytesIO(image_data)).convert('RGBA')
-                        num_colors_to_try = 10
-                        extracted_colors = colorgram.extract(pil_image, num_colors_to_try)
-
-                        if extracted_colors:
-                            selected_color_rgb = None
-                            for i in range(min(num_colors_to_try, len(extracted_colors))):
-                                c = extracted_colors[i].rgb
-                                luma = (
-                                    0.2126 * c.r / 255.0 +
-                                    0.7152 * c.g / 255.0 +
-                                    0.0722 * c.b / 255.0
-                                )
-                                if 0.2 < luma < 0.8:  # Not too dark, not too light
-                                    selected_color_rgb = c
-                                    break
-
-                            if not selected_color_rgb:  # Fallback to the first color
-                                selected_color_rgb = extracted_colors[0].rgb
-
-                            color_str = f"{selected_color_rgb.r}, {selected_color_rgb.g}, {selected_color_rgb.b}"
-                        else:
-                            logger.warning(f"Colorgram could not extract colors for image: {game['image']}")
-                    except Exception as e:
-                        logger.error(f"Error processing image for color extraction {game['image']}: {e}")
-
-            if not color_str:  # Default color if extraction fails or no image
-                color_str = "211, 211, 211"  # Light Grey
-
-            cursor.execute('''
-                INSERT INTO games (
-                    id, name, description, categories, mechanics, players,
-                    weight, playing_time, min_age, rank, usersrated, numowned,
-                    rating, numplays, image, thumbnail, tags, previous_players, expansions, color,
-                    alternate_names, comment, wishlist_comment, wishlist_priority,
-                    artists, designers, publishers, year, accessories, families, reimplements, reimplementedby,
-                    integrates, wl_exp, wl_acc, po_exp, po_acc, contained, weightRating, other_ranks,
-                    average, suggested_age, last_modified, version_name, version_year, collection_id, first_played, last_played
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            values = (
                 game.get('id'), game.get('name'), game.get('description'), categories_json, mechanics_json,
                 players_json,
                 float(game.get('weight')) if game.get('weight') is not None else None,
@@ -223,7 +217,7 @@ class SqliteIndexer:
                 int(game.get('numowned')) if game.get('numowned') is not None else None,
                 float(game.get('rating')) if game.get('rating') is not None else None,
                 game.get('numplays'), game.get('image'), game.get('thumbnail'), tags_json, previous_players_json,
-                expansions_json, color_str,
+                expansions_json,
                 alternate_names_json,
                 game.get('comment'),
                 game.get('wishlist_comment'),
@@ -241,11 +235,78 @@ class SqliteIndexer:
                 int(game.get('version_year')) if game.get('version_year') is not None else None,
                 int(game.get('collection_id')) if game.get('collection_id') is not None else None,
                 game.get('first_played'), game.get('last_played')
-            ))
+            )
+
+            collection_id = values[-3]
+            row_hash = hashlib.sha1(json.dumps(values, default=str).encode('utf-8')).hexdigest()
+            if existing_hashes.get(collection_id) == row_hash:
+                unchanged += 1
+                continue
+
+            rows.append((game, values, row_hash))
+
+        # Thumbnails are downloaded concurrently, rows are written in collection order
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            colors = executor.map(self._extract_color, [game for game, _, _ in rows])
+            colors = tqdm(colors, desc="Extracting colors", total=len(rows))
+            for (game, values, row_hash), color_str in zip(rows, colors):
+                cursor.execute('''
+                    INSERT OR REPLACE INTO games (
+                        id, name, description, categories, mechanics, players,
+                        weight, playing_time, min_age, rank, usersrated, numowned,
+                        rating, numplays, image, thumbnail, tags, previous_players, expansions,
+                        alternate_names, comment, wishlist_comment, wishlist_priority,
+                        artists, designers, publishers, year, accessories, families, reimplements, reimplementedby,
+                        integrates, wl_exp, wl_acc, po_exp, po_acc, contained, weightRating, other_ranks,
+                        average, suggested_age, last_modified, version_name, version_year, collection_id,
+                        first_played, last_played, row_hash, color
+                    ) VALUES (
+                        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                    )
+                ''', values + (row_hash, color_str))
 
         conn.commit()
         conn.close()
-        logger.info(f"Added {len(collection)} games to SQLite database")
+        logger.info(f"Added {len(collection) - unchanged} games to SQLite database ({unchanged} unchanged)")
+
+    def _extract_color(self, game) -> str:
+        """Pick a representative color from the game's thumbnail."""
+        color_str = None
+        if game.get("thumbnail"):
+            image_data = self.fetch_image(game["thumbnail"])
+            if image_data:
+                try:
+                    pil_image = Image.open(io.BytesIO(image_data)).convert('RGBA')
+                    num_colors_to_try = 10
+                    extracted_colors = colorgram.extract(pil_image, num_colors_to_try)
+
+                    if extracted_colors:
+                        selected_color_rgb = None
+                        for i in range(min(num_colors_to_try, len(extracted_colors))):
+                            c = extracted_colors[i].rgb
+                            luma = (
+                                0.2126 * c.r / 255.0 +
+                                0.7152 * c.g / 255.0 +
+                                0.0722 * c.b / 255.0
+                            )
+                            if 0.2 < luma < 0.8:  # Not too dark, not too light
+                                selected_color_rgb = c
+                                break
+
+                        if not selected_color_rgb:  # Fallback to the first color
+                            selected_color_rgb = extracted_colors[0].rgb
+
+                        color_str = f"{selected_color_rgb.r}, {selected_color_rgb.g}, {selected_color_rgb.b}"
+                    else:
+                        logger.warning(f"Colorgram could not extract colors for image: {game['image']}")
+                except Exception as e:
+                    logger.error(f"Error processing image for color extraction {game['image']}: {e}")
+
+        if not color_str:  # Default color if extraction fails or no image
+            color_str = "211, 211, 211"  # Light Grey
+
+        return color_str
 
     def _expansion_to_dict(self, expansion) -> Dict[str, Any]:
         """Convert expansion object to dictionary for JSON serialization."""
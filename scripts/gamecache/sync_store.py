@@ -0,0 +1,136 @@
+"""
+Persistent sync state for incremental GameCache runs.
+Keeps the last successful sync time and the collection items seen at that time, and
+per-game aggregates of the user's plays.
+"""
+
+import json
+import sqlite3
+
+
+class SyncStore:
+    """SQLite-backed store of collection sync state, keyed by request, and of play aggregates, keyed by user"""
+
+    def __init__(self, path="gamecache-sync.sqlite"):
+        """
+        Args:
+            path: Path of the sync database
+        """
+        self.path = path
+        self._init_store()
+
+    def _init_store(self):
+        """Initialize the sync database"""
+        conn = sqlite3.connect(self.path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                sync_key TEXT PRIMARY KEY,
+                last_sync REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS collection_items (
+                sync_key TEXT,
+                collection_id INTEGER,
+                data TEXT,
+                PRIMARY KEY (sync_key, collection_id)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS plays_sync_state (
+                user_name TEXT PRIMARY KEY,
+                last_sync REAL,
+                last_full_sync REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS play_aggregates (
+                user_name TEXT,
+                game_id INTEGER,
+                players TEXT,
+                first_played TEXT,
+                last_played TEXT,
+                PRIMARY KEY (user_name, game_id)
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def last_sync(self, sync_key):
+        """Returns the time of the last successful sync for sync_key, or None"""
+        conn = sqlite3.connect(self.path)
+        row = conn.execute("SELECT last_sync FROM sync_state WHERE sync_key = ?", (sync_key,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def collection(self, sync_key):
+        """Returns the stored collection items for sync_key as a dict of collection_id to item"""
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(
+            "SELECT collection_id, data FROM collection_items WHERE sync_key = ?",
+            (sync_key,)
+        ).fetchall()
+        conn.close()
+        return {collection_id: json.loads(data) for collection_id, data in rows}
+
+    def save(self, sync_key, synced_at, items):
+        """Replaces the stored items for sync_key and records synced_at as its last sync"""
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("DELETE FROM collection_items WHERE sync_key = ?", (sync_key,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO collection_items (sync_key, collection_id, data) VALUES (?, ?, ?)",
+                [(sync_key, item["collection_id"], json.dumps(item)) for item in items]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (sync_key, last_sync) VALUES (?, ?)",
+                (sync_key, synced_at)
+            )
+        conn.close()
+
+    def plays_sync(self, user_name):
+        """Returns the times of the last sync and the last full sync of user_name's plays, each possibly None"""
+        conn = sqlite3.connect(self.path)
+        row = conn.execute(
+            "SELECT last_sync, last_full_sync FROM plays_sync_state WHERE user_name = ?",
+            (user_name,)
+        ).fetchone()
+        conn.close()
+        return row if row else (None, None)
+
+    def play_aggregates(self, user_name):
+        """
+        Returns the stored play aggregates for user_name as a dict of game id to a dict of
+        its players (a set) and its first_played and last_played dates
+        """
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(
+            "SELECT game_id, players, first_played, last_played FROM play_aggregates WHERE user_name = ?",
+            (user_name,)
+        ).fetchall()
+        conn.close()
+        return {
+            game_id: {"players": set(json.loads(players)), "first_played": first_played, "last_played": last_played}
+            for game_id, players, first_played, last_played in rows
+        }
+
+    def save_play_aggregates(self, user_name, synced_at, aggregates, full=False):
+        """Replaces the stored play aggregates for user_name, recording synced_at as its last (full) sync"""
+        last_full_sync = synced_at if full else self.plays_sync(user_name)[1]
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("DELETE FROM play_aggregates WHERE user_name = ?", (user_name,))
+            conn.executemany(
+                "INSERT INTO play_aggregates (user_name, game_id, players, first_played, last_played) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (user_name, game_id, json.dumps(sorted(aggregate["players"])),
+                     aggregate["first_played"], aggregate["last_played"])
+                    for game_id, aggregate in aggregates.items()
+                ]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO plays_sync_state (user_name, last_sync, last_full_sync) VALUES (?, ?, ?)",
+                (user_name, synced_at, last_full_sync)
+            )
+        conn.close()
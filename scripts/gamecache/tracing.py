@@ -0,0 +1,44 @@
+"""
+Request tracing functionality for GameCache project.
+Records a structured event per BGG request and appends them to a JSON lines file for analysis.
+"""
+
+import json
+import threading
+import time as time_module
+
+
+class Tracer:
+    """Appends events to a JSONL file, or does nothing at all when no path is given"""
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: File the events are appended to, one JSON object per line (None to disable tracing)
+        """
+        self.path = path
+        self.enabled = bool(path)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, event, **fields):
+        """
+        Writes one event with the current time and fields.
+
+        Callers check enabled before collecting the fields, so a disabled tracer costs nothing.
+        """
+        if not self.enabled:
+            return
+
+        line = json.dumps({"time": round(time_module.time(), 3), "event": event, **fields}, default=str)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Inspect and prune the BGG cache created by download_and_index.py --cache_bgg.
+"""
+
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Add the scripts directory to the path for imports
+script_dir = Path(__file__).parent
+sys.path.insert(0, str(script_dir))
+
+# Now import after path is set
+from gamecache.cache_maintenance import CacheMaintainer  # noqa: E402
+from gamecache.downloader import CACHE_PATH, CACHE_TABLES  # noqa: E402
+from setup_logging import setup_logging  # noqa: E402
+
+def format_size(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+def print_stats(maintainer):
+    stats = maintainer.stats()
+    print(f"Cache file {maintainer.path}: {format_size(stats['file_bytes'])} "
+          f"({format_size(stats['live_bytes'])} in use, {format_size(stats['free_bytes'])} free)")
+    for table, table_stats in stats["tables"].items():
+        oldest = table_stats["oldest_access"]
+        oldest = datetime.fromtimestamp(oldest).strftime("%Y-%m-%d %H:%M") if oldest else "-"
+        print(f"  {table}: {table_stats['rows']} entries, {table_stats['expired']} expired, "
+              f"least recently used {oldest}")
+
+def main(args):
+    if not Path(args.path).exists():
+        print(f"No cache found at {args.path}")
+        sys.exit(1)
+
+    maintainer = CacheMaintainer(args.path, tables=CACHE_TABLES)
+
+    if args.command == "prune":
+        expired = maintainer.sweep_expired()
+        evicted = maintainer.evict(args.max_mb) if args.max_mb else 0
+        maintainer.compact()
+        print(f"Removed {expired} expired and {evicted} least recently used entries.")
+    elif args.command == "vacuum":
+        maintainer.compact(full=True)
+        print("Vacuumed the cache.")
+
+    print_stats(maintainer)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description='Inspect and prune the BGG cache')
+    parser.add_argument(
+        'command',
+        choices=["stats", "prune", "vacuum"],
+        nargs='?',
+        default="stats",
+        help=(
+            "stats shows what is in the cache (default), prune removes expired entries and "
+            "optionally evicts down to --max_mb, vacuum rebuilds the file to reclaim all free space."
+        )
+    )
+    parser.add_argument(
+        '--max_mb',
+        type=int,
+        help="With prune, evict least recently used entries until the cache fits in this many MB."
+    )
+    parser.add_argument(
+        '--path',
+        type=str,
+        default=CACHE_PATH,
+        help=f"Path to the cache file (default: {CACHE_PATH} from the working directory)."
+    )
+
+    args = parser.parse_args()
+
+    main(args)
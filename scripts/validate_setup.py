@@ -12,7 +12,7 @@ script_dir = Path(__file__).parent
 sys.path.insert(0, str(script_dir))
 
 # Now import after path is set
-from gamecache.config import parse_config_file  # noqa: E402
+from gamecache.config import parse_config_file, parse_statuses  # noqa: E402
 from gamecache.http_client import make_http_request  # noqa: E402
 
 def validate_config():
@@ -52,6 +52,14 @@ def validate_config():
             print(f"   Current value: {value}")
             return False
 
+    if "bgg_statuses" in config:
+        try:
+            parse_statuses(config["bgg_statuses"])
+        except ValueError as e:
+            print("❌ Invalid bgg_statuses in config.ini")
+            print(f"   Error: {e}")
+            return False
+
     print("✅ config.ini looks good!")
 
     # Convert flat config to nested structure for compatibility with other functions